@@ -1,9 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, make_response, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file, Response, stream_with_context
 from flask_pymongo import PyMongo
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
-from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.utils import secure_filename
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 from datetime import datetime, timedelta
 from functools import wraps
 import os
@@ -11,6 +11,13 @@ import logging
 import re
 import base64
 import mimetypes
+import csv
+import gzip
+import io
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import sys
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -27,6 +34,20 @@ app.config["MONGO_URI"] = "mongodb://localhost:27017/careorbit_db"
 from flask import request, redirect, url_for, flash, render_template
 from flask_login import login_required, current_user
 from app.utils.sms import send_appointment_sms
+from app.utils.cache import TTLCache
+from app.utils.passwords import PasswordHasher, PasswordHasherBusy
+from app.utils.tokens import issue_token, decode_token, RevocationList
+from app.utils.search import (
+    name_search_keys, name_prefix_query, patient_lookup_query, phone_key,
+    normalize_name, phonetic_key, trigrams, name_similarity, SEARCH_KEY_FIELDS,
+    prefix_regex, mask_phone, aadhaar_key
+)
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_filter, keyset_page
+from app.utils.search_cache import SearchResultCache
+from app.utils.ids import SequenceAllocator
+from app.utils.reference import ReferenceCache
+from app.utils.stats import count_patients_with_visits, age_histogram, age_in_years
+from app.utils.load_balancer import DepartmentLoadBalancer
 
 @app.route("/admin/send-sms", methods=["GET", "POST"])
 @login_required
@@ -147,31 +168,219 @@ def cleanup_old_files():
 # Initialize PyMongo
 mongo = PyMongo(app)
 
+# Principal cache: saves the admin/doctor lookups load_user does on every request. Invalidation only
+# reaches the worker that made the change, so the TTL is kept short: it bounds how long another worker
+# keeps serving a deleted or deactivated account.
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.getenv('PRINCIPAL_CACHE_SIZE', 2048))
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.getenv('PRINCIPAL_CACHE_TTL', 5))
+principal_cache = TTLCache(maxsize=app.config['PRINCIPAL_CACHE_SIZE'], ttl=app.config['PRINCIPAL_CACHE_TTL'])
+
+# Aadhaar numbers are matched through a keyed hash. The key is dedicated so rotating SECRET_KEY cannot
+# orphan stored hashes; after changing it, run `python database_setup.py --rehash-aadhaar` with the new key.
+app.config['AADHAAR_HASH_KEY'] = os.getenv('AADHAAR_HASH_KEY')
+if not app.config['AADHAAR_HASH_KEY']:
+    raise RuntimeError('AADHAAR_HASH_KEY must be set; Aadhaar duplicate checks need a dedicated, stable key')
+
+def aadhaar_hash(number):
+    return aadhaar_key(number, app.config['AADHAAR_HASH_KEY'])
+
+# Patient search responses, dropped precisely by patient and visit writes
+app.config['SEARCH_CACHE_SIZE'] = int(os.getenv('SEARCH_CACHE_SIZE', 512))
+app.config['SEARCH_CACHE_TTL'] = int(os.getenv('SEARCH_CACHE_TTL', 60))
+search_cache = SearchResultCache(maxsize=app.config['SEARCH_CACHE_SIZE'], ttl=app.config['SEARCH_CACHE_TTL'])
+
+# Departments and doctors, used to turn ids into names without a query per row.
+# Writers bump the shared `reference_data` version so every worker reloads within the refresh interval.
+app.config['REFERENCE_REFRESH_INTERVAL'] = int(os.getenv('REFERENCE_REFRESH_INTERVAL', 30))
+
+def load_reference_data():
+    return {
+        'departments': {department['_id']: department for department in mongo.db.department.find()},
+        'doctors': {
+            doctor['_id']: doctor
+            for doctor in mongo.db.doctor.find({}, {'password': 0, 'password_hash': 0})
+        }
+    }
+
+def load_reference_version():
+    version = mongo.db.counters.find_one({'_id': 'reference_data'})
+    return version['seq'] if version else 0
+
+reference_cache = ReferenceCache(
+    load_reference_data, load_reference_version,
+    refresh_interval=app.config['REFERENCE_REFRESH_INTERVAL']
+)
+
+def bump_reference_version():
+    """Call after any doctor/department write"""
+    mongo.db.counters.update_one({'_id': 'reference_data'}, {'$inc': {'seq': 1}}, upsert=True)
+    reference_cache.invalidate()
+
+def _reference_lookup(section, object_id):
+    if not object_id or not ObjectId.is_valid(object_id):
+        return None
+    return reference_cache.get(section, ObjectId(object_id))
+
+def get_doctor(doctor_id):
+    """Cached doctor document (without password fields); treat as read-only"""
+    return _reference_lookup('doctors', doctor_id)
+
+def get_department(department_id):
+    """Cached department document; treat as read-only"""
+    return _reference_lookup('departments', department_id)
+
+def lookup_doctor_name(doctor_id, default='Unknown'):
+    doctor = get_doctor(doctor_id)
+    return doctor.get('name', default) if doctor else default
+
+def lookup_department_name(department_id, default='Unknown'):
+    department = get_department(department_id)
+    return department.get('department_name', default) if department else default
+
+# Admin overview, cached briefly so many open dashboards share one computation
+app.config['OVERVIEW_CACHE_TTL'] = int(os.getenv('OVERVIEW_CACHE_TTL', 10))
+overview_cache = TTLCache(maxsize=1, ttl=app.config['OVERVIEW_CACHE_TTL'])
+
+# Age histograms per filter; dropped on registrations and patient updates in this process
+app.config['AGE_HISTOGRAM_CACHE_TTL'] = int(os.getenv('AGE_HISTOGRAM_CACHE_TTL', 300))
+age_histogram_cache = TTLCache(maxsize=64, ttl=app.config['AGE_HISTOGRAM_CACHE_TTL'])
+
+# Every in-process cache, reported by /api/admin/cache-stats
+app_caches = {
+    'principal': principal_cache, 'search': search_cache, 'reference': reference_cache,
+    'overview': overview_cache, 'age_histogram': age_histogram_cache
+}
+
+# Patient IDs come from an atomic counter and are strictly sequential by default. A block size > 1 lets
+# each worker reserve ids in bulk, making most registrations a single insert, at the cost of gaps after
+# a restart and ids interleaved across workers
+app.config['PATIENT_ID_BLOCK_SIZE'] = int(os.getenv('PATIENT_ID_BLOCK_SIZE', 1))
+
+def highest_patient_number():
+    """Largest numeric part of the existing PTnnnn ids, compared as numbers so PT10000 > PT9999"""
+    result = list(mongo.db.patient.aggregate([
+        {'$match': {'patient_id': {'$regex': '^PT[0-9]+$'}}},
+        {'$group': {'_id': None, 'max': {'$max': {'$toInt': {'$substrCP': ['$patient_id', 2, 32]}}}}}
+    ]))
+    return result[0]['max'] if result else 0
+
+patient_id_allocator = SequenceAllocator(
+    lambda: mongo.db.counters, 'patient_id',
+    block_size=app.config['PATIENT_ID_BLOCK_SIZE'],
+    seed=highest_patient_number
+)
+
+def next_patient_id():
+    return f"PT{patient_id_allocator.next():04d}"
+
+# Password KDF runs in a bounded process pool instead of on the request thread
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE_DEPTH'] = int(os.getenv('PASSWORD_HASH_QUEUE_DEPTH', 32))
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_QUEUE_DEPTH']
+)
+
+def upgrade_password_hash(collection, principal, password):
+    """Rehash at the configured KDF cost after a successful login and drop the legacy `password` field"""
+    try:
+        stored_hash = principal.get('password_hash')
+        rehash = not stored_hash or password_hasher.needs_rehash(stored_hash)
+        if not rehash and 'password' not in principal:
+            return
+        
+        update = {'$unset': {'password': ''}}
+        if rehash:
+            update['$set'] = {'password_hash': password_hasher.hash(password)}
+        mongo.db[collection].update_one({'_id': principal['_id']}, update)
+    except Exception as e:
+        logging.warning(f"Password hash upgrade failed for {collection} {principal.get('_id')}: {e}")
+
+def invalidate_principal(user_id):
+    """Drop a cached principal after its admin/doctor record changes"""
+    principal_cache.invalidate(str(user_id))
+
 # Initialize Flask-Login
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'index'
 
 class User(UserMixin):
-    def __init__(self, user_id, username, role, name):
+    def __init__(self, user_id, username, role, name, token_id=None):
         self.id = user_id
         self.username = username
         self.role = role
         self.name = name
+        self.token_id = token_id  # jti when authenticated by a bearer token rather than the session
+
+    def get_id(self):
+        # Session id carries the role ("doctor:<id>") so load_user queries one collection
+        return f"{self.role}:{self.id}"
+
+# Collections holding each kind of principal, in legacy lookup order
+PRINCIPAL_COLLECTIONS = ('admin', 'doctor')
+
+def load_principal(object_id, roles=PRINCIPAL_COLLECTIONS):
+    """(username, role, name) of an active admin/doctor via principal_cache; None if deleted or deactivated"""
+    cached = principal_cache.get(object_id)
+    if cached:
+        return cached if cached[1] in roles else None
+    if not ObjectId.is_valid(object_id):
+        return None
+    
+    for role in roles:
+        principal = mongo.db[role].find_one(
+            {'_id': ObjectId(object_id)},
+            {'username': 1, 'name': 1, 'is_active': 1}
+        )
+        if principal:
+            if principal.get('is_active') is False:
+                return None
+            cached = (principal['username'], role, principal['name'])
+            principal_cache.set(object_id, cached)
+            return cached
+    
+    return None
 
 @login_manager.user_loader
 def load_user(user_id):
-    # Try to find user in admin collection
-    admin = mongo.db.admin.find_one({'_id': ObjectId(user_id)})
-    if admin:
-        return User(str(admin['_id']), admin['username'], 'admin', admin['name'])
+    role, _, object_id = user_id.rpartition(':')
     
-    # Try to find user in doctor collection
-    doctor = mongo.db.doctor.find_one({'_id': ObjectId(user_id)})
-    if doctor:
-        return User(str(doctor['_id']), doctor['username'], 'doctor', doctor['name'])
+    # Sessions issued before the role was encoded in the id fall back to trying each collection
+    principal = load_principal(object_id, (role,) if role in PRINCIPAL_COLLECTIONS else PRINCIPAL_COLLECTIONS)
+    return User(object_id, *principal) if principal else None
+
+# Bearer tokens for kiosks and integrations: signed with SECRET_KEY; the principal behind each token is
+# checked through principal_cache, so deleting or deactivating an account also stops its tokens
+app.config['API_TOKEN_TTL'] = int(os.getenv('API_TOKEN_TTL', 900))
+app.config['API_TOKEN_REVOCATION_REFRESH'] = int(os.getenv('API_TOKEN_REVOCATION_REFRESH', 30))
+
+def load_revoked_token_ids():
+    return [doc['jti'] for doc in mongo.db.revoked_tokens.find(
+        {'expires_at': {'$gt': datetime.now()}},
+        {'jti': 1}
+    )]
+
+token_revocations = RevocationList(load_revoked_token_ids, app.config['API_TOKEN_REVOCATION_REFRESH'])
+
+@login_manager.request_loader
+def load_user_from_token(req):
+    auth_header = req.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
     
-    return None
+    payload = decode_token(app.config['SECRET_KEY'], auth_header[len('Bearer '):].strip())
+    if not payload or payload.get('role') not in PRINCIPAL_COLLECTIONS:
+        return None
+    if token_revocations.is_revoked(payload['jti']):
+        return None
+    
+    principal = load_principal(payload['sub'], (payload['role'],))
+    if not principal:
+        return None
+    return User(payload['sub'], *principal, token_id=payload['jti'])
 
 def role_required(roles):
     def decorator(f):
@@ -213,11 +422,7 @@ def admin_departments():
         return redirect(url_for('admin_dashboard'))
     
     # Calculate age
-    today = datetime.now()
-    age = today.year - patient['date_of_birth'].year
-    if today.month < patient['date_of_birth'].month or \
-       (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-        age -= 1
+    age = age_in_years(patient.get('date_of_birth'))
     
     patient['age'] = age
     return render_template('departments.html', patient=patient)
@@ -237,11 +442,7 @@ def admin_doctors():
         return redirect(url_for('admin_dashboard'))
     
     # Calculate age
-    today = datetime.now()
-    age = today.year - patient['date_of_birth'].year
-    if today.month < patient['date_of_birth'].month or \
-       (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-        age -= 1
+    age = age_in_years(patient.get('date_of_birth'))
     
     patient['age'] = age
     return render_template('doctors.html', patient=patient, department_name=department_name)
@@ -281,17 +482,7 @@ def get_past_patients():
             patient = mongo.db.patient.find_one({'_id': visit['patient_id']})
             if patient:
                 # Calculate age
-                try:
-                    today_date = datetime.now()
-                    if isinstance(patient['date_of_birth'], datetime):
-                        age = today_date.year - patient['date_of_birth'].year
-                        if today_date.month < patient['date_of_birth'].month or \
-                           (today_date.month == today_date.month and today_date.day < patient['date_of_birth'].day):
-                            age -= 1
-                    else:
-                        age = 0
-                except:
-                    age = 0
+                age = age_in_years(patient.get('date_of_birth'))
                 
                 patient_data = {
                     'visit_id': str(visit['_id']),
@@ -320,17 +511,12 @@ def doctor_dashboard():
     try:
         doctor_id = current_user.id
         
-        doctor = mongo.db.doctor.find_one({'_id': ObjectId(doctor_id)})
+        doctor = get_doctor(doctor_id)
         doctor_info = {
             'name': doctor.get('name', session.get('username', 'Unknown')),
-            'department': 'Unknown Department'  # Default value
+            'department': lookup_department_name(doctor.get('department_id'), 'Unknown Department')
         } if doctor else None
         
-        if doctor and 'department_id' in doctor:
-            department = mongo.db.department.find_one({'_id': ObjectId(doctor['department_id'])})
-            if department:
-                doctor_info['department'] = department.get('department_name', 'Unknown Department')
-        
         # Get today's assigned patients with patient details
         today = datetime.now().date()
         start_of_day = datetime.combine(today, datetime.min.time())
@@ -338,53 +524,51 @@ def doctor_dashboard():
         
         print(f"Doctor {doctor_id} looking for visits between {start_of_day} and {end_of_day}")
         
-        visits = list(mongo.db.visit.find({
-            'doctor_id': ObjectId(doctor_id),
-            'visit_date': {'$gte': start_of_day, '$lte': end_of_day}
-        }).sort([('status', 1), ('visit_date', 1)]))  # Sort by status first (assigned/pending before completed), then by time
+        # One round trip: the patient is joined on the server and only the fields the template shows come back
+        visits = list(mongo.db.visit.aggregate([
+            {'$match': {
+                'doctor_id': ObjectId(doctor_id),
+                'visit_date': {'$gte': start_of_day, '$lte': end_of_day}
+            }},
+            {'$sort': {'status': 1, 'visit_date': 1}},  # Sort by status first (assigned/pending before completed), then by time
+            {'$lookup': {
+                'from': 'patient',
+                'localField': 'patient_id',
+                'foreignField': '_id',
+                'as': 'patient'
+            }},
+            {'$unwind': '$patient'},  # Drops visits whose patient no longer exists
+            {'$project': {
+                'reason_for_visit': 1, 'visit_date': 1, 'status': 1,
+                'patient._id': 1, 'patient.patient_id': 1, 'patient.name': 1, 'patient.contact_number': 1,
+                'patient.gender': 1, 'patient.address': 1, 'patient.date_of_birth': 1,
+                'patient.allergies': 1, 'patient.chronic_illness': 1
+            }}
+        ]))
         
         print(f"Found {len(visits)} visits for doctor {doctor_id}")
         
+        today_now = datetime.now()
         patients_data = []
         for visit in visits:
-            patient = mongo.db.patient.find_one({'_id': visit['patient_id']})
-            if patient:
-                # Calculate age
-                try:
-                    today_date = datetime.now()
-                    if isinstance(patient['date_of_birth'], datetime):
-                        age = today_date.year - patient['date_of_birth'].year
-                        if today_date.month < patient['date_of_birth'].month or \
-                           (today_date.month == today_date.month and today_date.day < patient['date_of_birth'].day):
-                            age -= 1
-                    else:
-                        age = 0
-                except:
-                    age = 0
-                
-                visit_data = {
-                    '_id': str(visit['_id']),
-                    'patient_details': {
-                        'patient_id': patient['patient_id'],
-                        'name': patient['name'],
-                        'contact_number': patient['contact_number'],
-                        'gender': patient['gender'],
-                        'address': patient['address'],
-                        'age': age,  # Added age to patient_details
-                        'allergies': patient.get('allergies', 'None'),
-                        'chronic_conditions': patient.get('chronic_illness', 'None'),
-                        '_id': str(patient['_id'])  # Add MongoDB ObjectId for history functionality
-                    },
-                    'reason_for_visit': visit.get('reason_for_visit', 'General consultation'),
-                    'visit_date': visit['visit_date'],  # Fixed field name
-                    'status': visit['status'],
-                    'symptoms': visit.get('symptoms', ''),
-                    'diagnosis': visit.get('diagnosis', ''),
-                    'medications': visit.get('medications', ''),
-                    'instructions': visit.get('instructions', ''),
-                    'follow_up_date': visit.get('follow_up_date')
-                }
-                patients_data.append(visit_data)
+            patient = visit['patient']
+            patients_data.append({
+                '_id': str(visit['_id']),
+                'patient_details': {
+                    'patient_id': patient.get('patient_id'),
+                    'name': patient.get('name'),
+                    'contact_number': patient.get('contact_number'),
+                    'gender': patient.get('gender'),
+                    'address': patient.get('address', ''),
+                    'age': age_in_years(patient.get('date_of_birth'), today_now),
+                    'allergies': patient.get('allergies', 'None'),
+                    'chronic_conditions': patient.get('chronic_illness', 'None'),
+                    '_id': str(patient['_id'])  # Add MongoDB ObjectId for history functionality
+                },
+                'reason_for_visit': visit.get('reason_for_visit', 'General consultation'),
+                'visit_date': visit['visit_date'],
+                'status': visit['status']
+            })
         
         print(f"Returning {len(patients_data)} patients to template")
         return render_template('doctor_dashboard.html', patients=patients_data, doctor_info=doctor_info)
@@ -403,15 +587,13 @@ def doctor_search_patients():
         if not search_term:
             return jsonify({'success': False, 'message': 'Search term is required'})
         
-        # Search patients by name, phone, or patient ID
-        search_regex = re.compile(search_term, re.IGNORECASE)
-        patients = list(mongo.db.patient.find({
-            '$or': [
-                {'name': search_regex},
-                {'contact_number': search_regex},
-                {'patient_id': search_regex}
-            ]
-        }))
+        cache_key = search_cache.key('doctor_search', current_user.role, term=search_term)
+        cached = search_cache.get(cache_key)
+        if cached:
+            return jsonify(cached)
+        
+        # Search patients by name, phone, or patient ID prefix
+        patients = list(mongo.db.patient.find(patient_lookup_query(search_term)))
         
         patients_data = []
         for patient in patients:
@@ -423,17 +605,7 @@ def doctor_search_patients():
             )
             
             # Calculate age
-            try:
-                today_date = datetime.now()
-                if isinstance(patient['date_of_birth'], datetime):
-                    age = today_date.year - patient['date_of_birth'].year
-                    if today_date.month < patient['date_of_birth'].month or \
-                       (today_date.month == today_date.month and today_date.day < patient['date_of_birth'].day):
-                        age -= 1
-                else:
-                    age = 0
-            except:
-                age = 0
+            age = age_in_years(patient.get('date_of_birth'))
             
             patient_data = {
                 'patient_id': patient['patient_id'],
@@ -448,10 +620,12 @@ def doctor_search_patients():
             }
             patients_data.append(patient_data)
         
-        return jsonify({
+        payload = {
             'success': True,
             'patients': patients_data
-        })
+        }
+        search_cache.set(cache_key, payload, [patient['_id'] for patient in patients])
+        return jsonify(payload)
         
     except Exception as e:
         print(f"Doctor patient search error: {str(e)}")
@@ -465,8 +639,10 @@ def admin_login_api():
         password = data.get('password')
         
         admin = mongo.db.admin.find_one({'username': username})
+        stored_hash = (admin.get('password_hash') or admin.get('password')) if admin else None
         
-        if admin and check_password_hash(admin['password_hash'], password):
+        if admin and password_hasher.verify(stored_hash, password):
+            upgrade_password_hash('admin', admin, password)
             user = User(str(admin['_id']), admin['username'], 'admin', admin['name'])
             login_user(user)
             return jsonify({
@@ -477,6 +653,8 @@ def admin_login_api():
         else:
             return jsonify({'success': False, 'message': 'Invalid credentials'})
             
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
     except Exception as e:
         return jsonify({'success': False, 'message': 'Login error occurred'})
 
@@ -488,8 +666,10 @@ def doctor_login_api():
         password = data.get('password')
         
         doctor = mongo.db.doctor.find_one({'username': username})
+        stored_hash = (doctor.get('password_hash') or doctor.get('password')) if doctor else None
         
-        if doctor and check_password_hash(doctor['password_hash'], password):
+        if doctor and password_hasher.verify(stored_hash, password):
+            upgrade_password_hash('doctor', doctor, password)
             user = User(str(doctor['_id']), doctor['username'], 'doctor', doctor['name'])
             login_user(user)
             session['user_id'] = str(doctor['_id'])
@@ -502,15 +682,192 @@ def doctor_login_api():
         else:
             return jsonify({'success': False, 'message': 'Invalid credentials'})
             
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
     except Exception as e:
         return jsonify({'success': False, 'message': 'Login error occurred'})
 
+@app.route('/api/auth/token', methods=['POST'])
+@role_required(['admin', 'doctor'])
+def create_api_token():
+    # Tokens cannot mint tokens, otherwise a leaked token could be renewed forever and outlive its revocation
+    if current_user.token_id:
+        return jsonify({'success': False, 'message': 'Sign in with a password to issue API tokens'}), 403
+    
+    ttl = app.config['API_TOKEN_TTL']
+    token = issue_token(
+        app.config['SECRET_KEY'],
+        current_user.id,
+        current_user.role,
+        current_user.username,
+        current_user.name,
+        ttl=ttl
+    )
+    return jsonify({
+        'success': True,
+        'token': token,
+        'token_type': 'Bearer',
+        'expires_in': ttl
+    })
+
+@app.route('/api/auth/token/revoke', methods=['POST'])
+@role_required(['admin'])
+def revoke_api_token():
+    try:
+        data = request.get_json()
+        payload = decode_token(app.config['SECRET_KEY'], data.get('token', ''))
+        if not payload:
+            return jsonify({'success': False, 'message': 'Token is invalid or already expired'})
+        
+        mongo.db.revoked_tokens.update_one(
+            {'jti': payload['jti']},
+            {'$set': {
+                'jti': payload['jti'],
+                'principal_id': payload['sub'],
+                'expires_at': datetime.fromtimestamp(payload['exp']),
+                'revoked_at': datetime.now(),
+                'revoked_by': ObjectId(current_user.id)
+            }},
+            upsert=True
+        )
+        token_revocations.add(payload['jti'])
+        
+        return jsonify({'success': True, 'message': 'Token revoked'})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Revoke error: {str(e)}'})
+
 @app.route('/api/logout', methods=['POST'])
 @login_required
 def logout():
     logout_user()
     return jsonify({'success': True, 'message': 'Logged out successfully'})
 
+# Newest first; _id breaks ties so history cursors never skip or repeat a visit
+VISIT_HISTORY_SORT = [('visit_date', -1), ('_id', -1)]
+app.config['SEARCH_VISIT_LIMIT'] = int(os.getenv('SEARCH_VISIT_LIMIT', 5))
+
+def format_history_visits(visits):
+    """
+    Shape raw visits for the search responses. Doctor and department names
+    come from the reference cache.
+    """
+    formatted = []
+    for visit in visits:
+        try:
+            visit_date = visit.get('visit_date_time') or visit.get('visit_date')
+            if visit_date:
+                if isinstance(visit_date, datetime):
+                    visit_date_str = visit_date.strftime('%Y-%m-%d %H:%M')
+                else:
+                    visit_date_str = str(visit_date)
+            else:
+                visit_date_str = 'Date not available'
+            
+            formatted.append({
+                'visit_id': str(visit['_id']),
+                'visit_date_time': visit_date_str,
+                'doctor_name': lookup_doctor_name(visit.get('doctor_id')),
+                'department_name': lookup_department_name(visit.get('department_id')),
+                'diagnosis': visit.get('diagnosis', ''),
+                'medications': visit.get('medications', ''),
+                'follow_up_date': visit['follow_up_date'].strftime('%Y-%m-%d') if visit.get('follow_up_date') else '',
+                'prescription_image': visit.get('prescription_image', '')
+            })
+        except Exception as visit_error:
+            print(f"Error processing visit: {visit_error}")
+            continue
+    
+    return formatted
+
+def visit_history_cursor(visit):
+    return encode_cursor([visit.get('visit_date'), visit['_id']])
+
+def get_visit_histories(patient_ids, limit=None):
+    """
+    The `limit` most recent visits for each patient plus a total count and a
+    cursor for /api/patient/<id>/visits. One $lookup reads at most limit + 1
+    visits per patient from the (patient_id, visit_date) index, the extra one
+    detecting truncation; a second grouped count returns totals without
+    loading any visit documents. Name lookups are batched.
+    Returns {patient ObjectId: {'visits', 'visit_count', 'has_more_visits', 'visits_cursor'}}.
+    """
+    limit = limit or app.config['SEARCH_VISIT_LIMIT']
+    histories = {}
+    if not patient_ids:
+        return histories
+    
+    recent_visits = {
+        patient['_id']: patient['visits']
+        for patient in mongo.db.patient.aggregate([
+            {'$match': {'_id': {'$in': list(patient_ids)}}},
+            {'$project': {'_id': 1}},
+            {'$lookup': {
+                'from': 'visit',
+                'let': {'patient_id': '$_id'},
+                'pipeline': [
+                    {'$match': {'$expr': {'$eq': ['$patient_id', '$$patient_id']}}},
+                    {'$sort': dict(VISIT_HISTORY_SORT)},
+                    {'$limit': limit + 1}
+                ],
+                'as': 'visits'
+            }}
+        ])
+    }
+    visit_counts = {
+        row['_id']: row['count']
+        for row in mongo.db.visit.aggregate([
+            {'$match': {'patient_id': {'$in': list(patient_ids)}}},
+            {'$group': {'_id': '$patient_id', 'count': {'$sum': 1}}}
+        ])
+    }
+    
+    page_visits = [visit for visits in recent_visits.values() for visit in visits[:limit]]
+    formatted_by_id = {visit['visit_id']: visit for visit in format_history_visits(page_visits)}
+    
+    for patient_id in patient_ids:
+        visits = recent_visits.get(patient_id, [])
+        has_more = len(visits) > limit
+        visits = visits[:limit]
+        histories[patient_id] = {
+            'visits': [formatted_by_id[str(visit['_id'])] for visit in visits if str(visit['_id']) in formatted_by_id],
+            'visit_count': visit_counts.get(patient_id, 0),
+            'has_more_visits': has_more,
+            'visits_cursor': visit_history_cursor(visits[-1]) if has_more else None
+        }
+    
+    return histories
+
+@app.route('/api/patient/<patient_id>/visits')
+@role_required(['admin', 'doctor'])
+def get_patient_visits_page(patient_id):
+    """Continue a search response's truncated visit history using its cursor"""
+    try:
+        limit = min(int(request.args.get('limit', 20)), 100)
+        query = {'patient_id': ObjectId(patient_id)}
+        
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                query.update(keyset_filter(VISIT_HISTORY_SORT, decode_cursor(cursor, len(VISIT_HISTORY_SORT))))
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+        
+        visits = list(mongo.db.visit.find(query).sort(VISIT_HISTORY_SORT).limit(limit + 1))
+        has_more = len(visits) > limit
+        visits = visits[:limit]
+        
+        return jsonify({
+            'success': True,
+            'visits': format_history_visits(visits),
+            'has_more': has_more,
+            'cursor': visit_history_cursor(visits[-1]) if has_more else None
+        })
+        
+    except Exception as e:
+        print(f"Patient visits page error: {str(e)}")
+        return jsonify({'success': False, 'message': f'Error fetching visits: {str(e)}'})
+
 @app.route('/api/patient/search', methods=['POST'])
 @role_required('admin')
 def search_patient():
@@ -521,30 +878,28 @@ def search_patient():
         
         query = {}
         if phone:
-            query['contact_number'] = phone
+            query['phone_key'] = phone_key(phone)
         if name:
-            query['name'] = {'$regex': name, '$options': 'i'}
+            query.update(name_prefix_query(name) or {})
             
         if not query:
             return jsonify({'success': False, 'message': 'Please provide search criteria'})
         
+        cache_key = search_cache.key(
+            'search', current_user.role,
+            phone=query.get('phone_key', ''),
+            name=normalize_name(name)
+        )
+        cached = search_cache.get(cache_key)
+        if cached:
+            return jsonify(cached)
+        
         print(f"Searching for patient with query: {query}")
         patient = mongo.db.patient.find_one(query)
         print(f"Patient found: {patient is not None}")
         
         if patient:
-            try:
-                today = datetime.now()
-                if isinstance(patient['date_of_birth'], datetime):
-                    age = today.year - patient['date_of_birth'].year
-                    if today.month < patient['date_of_birth'].month or \
-                       (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-                        age -= 1
-                else:
-                    age = 0  # Default age if date_of_birth is not a datetime
-            except Exception as age_error:
-                print(f"Age calculation error: {age_error}")
-                age = 0
+            age = age_in_years(patient.get('date_of_birth'))
 
             patient_data = {
                 '_id': str(patient['_id']),
@@ -561,57 +916,71 @@ def search_patient():
             }
 
             try:
-                visits = list(mongo.db.visit.find(
-                    {'patient_id': patient['_id']}
-                ))
-                
-                # Sort visits by visit_date if it exists, otherwise by _id
-                visits.sort(key=lambda x: x.get('visit_date', x.get('_id')), reverse=True)
-
-                visit_history = []
-                for visit in visits:
-                    try:
-                        doctor = mongo.db.doctor.find_one({'_id': visit.get('doctor_id')})
-                        department = mongo.db.department.find_one({'_id': visit.get('department_id')})
-
-                        visit_date = visit.get('visit_date_time') or visit.get('visit_date')
-                        if visit_date:
-                            if isinstance(visit_date, datetime):
-                                visit_date_str = visit_date.strftime('%Y-%m-%d %H:%M')
-                            else:
-                                visit_date_str = str(visit_date)
-                        else:
-                            visit_date_str = 'Date not available'
-
-                        visit_data = {
-                            'visit_id': str(visit['_id']),
-                            'visit_date_time': visit_date_str,
-                            'doctor_name': doctor['name'] if doctor else 'Unknown',
-                            'department_name': department['department_name'] if department else 'Unknown',
-                            'diagnosis': visit.get('diagnosis', ''),
-                            'medications': visit.get('medications', ''),
-                            'follow_up_date': visit['follow_up_date'].strftime('%Y-%m-%d') if visit.get('follow_up_date') else '',
-                            'prescription_image': visit.get('prescription_image', '')  # Added prescription image field
-                        }
-                        visit_history.append(visit_data)
-                    except Exception as visit_error:
-                        print(f"Error processing visit: {visit_error}")
-                        continue
-
+                patient_data.update(get_visit_histories([patient['_id']])[patient['_id']])
             except Exception as visit_history_error:
                 print(f"Error retrieving visit history: {visit_history_error}")
-                visit_history = []
-
-            patient_data['visits'] = visit_history
+                patient_data['visits'] = []
 
-            return jsonify({'success': True, 'patient': patient_data})
+            payload = {'success': True, 'patient': patient_data}
+            search_cache.set(cache_key, payload, [patient['_id']])
+            return jsonify(payload)
         else:
-            return jsonify({'success': False, 'message': 'Patient not found'})
+            payload = {'success': False, 'message': 'Patient not found'}
+            search_cache.set(cache_key, payload, [])
+            return jsonify(payload)
             
     except Exception as e:
         print(f"Patient search error: {str(e)}")
         return jsonify({'success': False, 'message': f'Search error: {str(e)}'})
 
+def build_patient_document(data, patient_id):
+    """Patient document for registration payloads ({name, phone, dob, gender, address, aadhaar, ...})"""
+    aadhaar = data.get('aadhaar', '').strip()
+    patient_data = {
+        'patient_id': patient_id,
+        'name': data['name'].strip(),
+        'contact_number': data['phone'].strip(),  # Frontend sends 'phone'
+        'phone_key': phone_key(data['phone']),
+        'aadhaar_number': aadhaar,  # Frontend sends 'aadhaar'
+        'date_of_birth': datetime.strptime(data['dob'], '%Y-%m-%d'),  # Frontend sends 'dob'
+        'gender': data['gender'],
+        'address': data['address'].strip(),
+        'allergies': data.get('allergies', '').strip(),
+        'chronic_illness': data.get('chronic_illness', '').strip(),
+        'created_at': datetime.now(),
+        **name_search_keys(data['name'])
+    }
+    aadhaar_key_value = aadhaar_hash(aadhaar)
+    if aadhaar_key_value:
+        # Left unset when there are no digits ("", "N/A") so the sparse unique index ignores the patient
+        patient_data['aadhaar_hash'] = aadhaar_key_value
+    return patient_data
+
+def duplicate_patient_message(error, data):
+    """Explain a registration DuplicateKeyError, naming the patient that already holds the key"""
+    details = error.details or {}
+    key_pattern = details.get('keyPattern') or {}
+    key_value = details.get('keyValue') or {}
+    if not key_pattern:
+        # Servers before 4.4 only report the index name in errmsg
+        errmsg = details.get('errmsg', str(error))
+        if 'aadhaar_hash' in errmsg:
+            key_pattern = {'aadhaar_hash': 1}
+        elif 'name' in errmsg and 'contact_number' in errmsg:
+            key_pattern = {'name': 1, 'contact_number': 1}
+    
+    if 'aadhaar_hash' in key_pattern:
+        query = key_value or {'aadhaar_hash': aadhaar_hash(data.get('aadhaar', ''))}
+        existing = mongo.db.patient.find_one(query, {'patient_id': 1})
+        suffix = f' (Patient ID: {existing["patient_id"]})' if existing else ''
+        return f'A patient with Aadhaar number "{data.get("aadhaar", "").strip()}" is already registered{suffix}'
+    if 'name' in key_pattern and 'contact_number' in key_pattern:
+        query = key_value or {'name': data['name'].strip(), 'contact_number': data['phone'].strip()}
+        existing = mongo.db.patient.find_one(query, {'patient_id': 1})
+        suffix = f' (Patient ID: {existing["patient_id"]})' if existing else ''
+        return f'A patient with the name "{data["name"]}" and phone number "{data["phone"]}" is already registered{suffix}'
+    return 'Patient registration failed due to duplicate information'
+
 @app.route('/api/patient/register', methods=['POST'])
 @role_required(['admin'])
 def register_patient():
@@ -623,80 +992,29 @@ def register_patient():
             if not data.get(field):
                 return jsonify({'success': False, 'message': f'{field.title()} is required'})
         
-        existing_name_phone = mongo.db.patient.find_one({
-            'name': data['name'].strip(),
-            'contact_number': data['phone'].strip()
-        })
-        
-        if existing_name_phone:
-            return jsonify({
-                'success': False, 
-                'message': f'A patient with the name "{data["name"]}" and phone number "{data["phone"]}" is already registered (Patient ID: {existing_name_phone["patient_id"]})'
-            })
-        
-        aadhaar = data.get('aadhaar', '').strip()
-        if aadhaar:
-            existing_aadhaar = mongo.db.patient.find_one({
-                'aadhaar_number': aadhaar
-            })
-            
-            if existing_aadhaar:
-                return jsonify({
-                    'success': False, 
-                    'message': f'A patient with Aadhaar number "{aadhaar}" is already registered (Patient ID: {existing_aadhaar["patient_id"]})'
-                })
-        
-        # Generate patient ID
-        last_patient = mongo.db.patient.find_one(sort=[('patient_id', -1)])
-        if last_patient:
-            last_id = int(last_patient['patient_id'][2:])  # Remove 'PT' prefix
-            new_patient_id = f"PT{last_id + 1:04d}"
-        else:
-            new_patient_id = "PT0001"
-        
-        patient_data = {
-            'patient_id': new_patient_id,
-            'name': data['name'].strip(),
-            'contact_number': data['phone'].strip(),  # Frontend sends 'phone'
-            'aadhaar_number': aadhaar,  # Frontend sends 'aadhaar'
-            'date_of_birth': datetime.strptime(data['dob'], '%Y-%m-%d'),  # Frontend sends 'dob'
-            'gender': data['gender'],
-            'address': data['address'].strip(),
-            'allergies': data.get('allergies', '').strip(),
-            'chronic_illness': data.get('chronic_illness', '').strip(),
-            'created_at': datetime.now()
-        }
-        
-        try:
-            result = mongo.db.patient.insert_one(patient_data)
-        except Exception as db_error:
-            if 'duplicate key' in str(db_error).lower():
-                if 'name' in str(db_error) and 'contact_number' in str(db_error):
-                    return jsonify({
-                        'success': False, 
-                        'message': 'A patient with this name and phone number combination already exists'
-                    })
-                elif 'aadhaar_number' in str(db_error):
-                    return jsonify({
-                        'success': False, 
-                        'message': 'A patient with this Aadhaar number already exists'
-                    })
-                else:
-                    return jsonify({
-                        'success': False, 
-                        'message': 'Patient registration failed due to duplicate information'
-                    })
-            else:
-                raise db_error
+        # Optimistic insert: the unique indexes do the duplicate checks in the same round trip
+        patient_data = build_patient_document(data, next_patient_id())
+        for attempt in range(2):
+            try:
+                result = mongo.db.patient.insert_one(patient_data)
+                break
+            except DuplicateKeyError as e:
+                key_pattern = (e.details or {}).get('keyPattern') or {}
+                if 'patient_id' in key_pattern and attempt == 0:
+                    # Id already taken outside the counter (e.g. a hand-inserted patient); move on to the next one
+                    patient_data.pop('_id', None)
+                    patient_data['patient_id'] = next_patient_id()
+                    continue
+                return jsonify({'success': False, 'message': duplicate_patient_message(e, data)})
         
         if result.inserted_id:
+            search_cache.invalidate_patient_write(result.inserted_id, patient_data)
+            age_histogram_cache.clear()
+            
             # Calculate age for response
-            today = datetime.now()
-            age = today.year - patient_data['date_of_birth'].year
-            if today.month < patient_data['date_of_birth'].month or \
-               (today.month == patient_data['date_of_birth'].month and today.day < patient_data['date_of_birth'].day):
-                age -= 1
+            age = age_in_years(patient_data.get('date_of_birth'))
             
+            patient_data = {key: value for key, value in patient_data.items() if key not in SEARCH_KEY_FIELDS}
             patient_data['_id'] = str(result.inserted_id)
             patient_data['age'] = age
             patient_data['visits'] = []  # New patient has no visits
@@ -712,6 +1030,163 @@ def register_patient():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Registration error: {str(e)}'})
 
+# Bulk import: rows are written in unordered batches; only one batch is held in memory
+app.config['PATIENT_IMPORT_BATCH_SIZE'] = int(os.getenv('PATIENT_IMPORT_BATCH_SIZE', 500))
+app.config['PATIENT_IMPORT_MAX_ERRORS'] = int(os.getenv('PATIENT_IMPORT_MAX_ERRORS', 1000))
+PATIENT_IMPORT_FIELDS = ('name', 'phone', 'dob', 'gender', 'address', 'aadhaar', 'allergies', 'chronic_illness')
+
+def iter_import_rows(upload, file_format):
+    """Yield (row_number, row_dict or None, error) from a CSV or NDJSON upload without reading it whole"""
+    text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+
+    for row_number, line in enumerate(text, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield row_number, None, f'Invalid JSON: {e}'
+            continue
+        if isinstance(row, dict):
+            yield row_number, row, None
+        else:
+            yield row_number, None, 'Each line must be a JSON object'
+
+def import_row_document(row):
+    """Validate an import row; returns (patient document without patient_id, error)"""
+    data = {field: str(row.get(field) or '').strip() for field in PATIENT_IMPORT_FIELDS}
+    for field in ('name', 'phone', 'dob', 'gender', 'address'):
+        if not data[field]:
+            return None, f'{field.title()} is required'
+    try:
+        return build_patient_document(data, None), None
+    except ValueError:
+        return None, 'Dob must be in YYYY-MM-DD format'
+
+def describe_duplicate(key_pattern):
+    if 'aadhaar_hash' in key_pattern:
+        return 'A patient with this Aadhaar number already exists'
+    if 'patient_id' in key_pattern:
+        return 'Patient ID conflict, please retry this row'
+    return 'A patient with this name and phone number combination already exists'
+
+def insert_import_batch(batch):
+    """
+    Insert [(row_number, document)] in one unordered round trip; returns
+    (inserted, duplicates, failures), the last two being row error lists.
+    Only duplicate-key errors on the patient's own keys count as duplicates;
+    patient ID conflicts and any other write error are failures.
+    """
+    for patient_number, (_, document) in zip(patient_id_allocator.allocate(len(batch)), batch):
+        document['patient_id'] = f"PT{patient_number:04d}"
+    try:
+        mongo.db.patient.insert_many([document for _, document in batch], ordered=False)
+        return len(batch), [], []
+    except BulkWriteError as bwe:
+        duplicates, failures = [], []
+        for write_error in bwe.details.get('writeErrors', []):
+            row = batch[write_error['index']][0]
+            if write_error.get('code') == 11000:
+                key_pattern = write_error.get('keyPattern') or write_error.get('errmsg', '')
+                error = {'row': row, 'message': describe_duplicate(key_pattern)}
+                (failures if 'patient_id' in key_pattern else duplicates).append(error)
+            else:
+                failures.append({'row': row, 'message': write_error.get('errmsg', 'Write failed')})
+        return bwe.details.get('nInserted', 0), duplicates, failures
+
+@app.route('/api/patients/import', methods=['POST'])
+@role_required(['admin'])
+def import_patients():
+    """
+    Register patients from an uploaded CSV (header row) or NDJSON file using the
+    same fields as /api/patient/register. Rows are checked against each other
+    within a batch and against the unique indexes on insert.
+    """
+    try:
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            return jsonify({'success': False, 'message': 'No file uploaded'})
+        
+        file_format = (request.form.get('format') or upload.filename.rsplit('.', 1)[-1]).lower()
+        if file_format in ('json', 'jsonl', 'ndjson'):
+            file_format = 'ndjson'
+        elif file_format != 'csv':
+            return jsonify({'success': False, 'message': 'File must be CSV or NDJSON'})
+        
+        batch_size = app.config['PATIENT_IMPORT_BATCH_SIZE']
+        max_errors = app.config['PATIENT_IMPORT_MAX_ERRORS']
+        stats = {'rows': 0, 'inserted': 0, 'invalid': 0, 'duplicates': 0, 'failed': 0}
+        errors = []
+        
+        def report(error):
+            if len(errors) < max_errors:
+                errors.append(error)
+        
+        def flush(batch):
+            inserted, duplicates, failures = insert_import_batch(batch)
+            stats['inserted'] += inserted
+            stats['duplicates'] += len(duplicates)
+            stats['failed'] += len(failures)
+            for error in sorted(duplicates + failures, key=lambda error: error['row']):
+                report(error)
+        
+        started = time.monotonic()
+        batch = []
+        batch_keys = {}  # Duplicate keys within the current batch -> first row number
+        for row_number, row, error in iter_import_rows(upload, file_format):
+            stats['rows'] += 1
+            document = None
+            if not error:
+                document, error = import_row_document(row)
+            if error:
+                stats['invalid'] += 1
+                report({'row': row_number, 'message': error})
+                continue
+            
+            keys = [('name_phone', document['name'], document['contact_number'])]
+            if 'aadhaar_hash' in document:
+                keys.append(('aadhaar', document['aadhaar_hash']))
+            duplicate_of = next((batch_keys[key] for key in keys if key in batch_keys), None)
+            if duplicate_of:
+                stats['duplicates'] += 1
+                report({'row': row_number, 'message': f'Duplicate of row {duplicate_of} in this file'})
+                continue
+            
+            batch_keys.update((key, row_number) for key in keys)
+            batch.append((row_number, document))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch, batch_keys = [], {}
+        
+        if batch:
+            flush(batch)
+        
+        if stats['inserted']:
+            search_cache.clear()
+            age_histogram_cache.clear()
+        
+        elapsed = time.monotonic() - started
+        stats['elapsed_seconds'] = round(elapsed, 3)
+        stats['rows_per_second'] = round(stats['rows'] / elapsed, 1) if elapsed else stats['rows']
+        
+        return jsonify({
+            'success': True,
+            'message': f"Imported {stats['inserted']} of {stats['rows']} patients",
+            'stats': stats,
+            'errors': errors,
+            'errors_truncated': stats['invalid'] + stats['duplicates'] + stats['failed'] > len(errors)
+        })
+        
+    except UnicodeDecodeError:
+        return jsonify({'success': False, 'message': 'File must be UTF-8 encoded'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Import error: {str(e)}'})
+
 @app.route('/api/patients/by-phone', methods=['POST'])
 @role_required(['admin'])
 def search_patients_by_phone():
@@ -722,58 +1197,19 @@ def search_patients_by_phone():
         if not phone:
             return jsonify({'success': False, 'message': 'Phone number is required'})
         
-        # Find all patients with this phone number
-        patients = list(mongo.db.patient.find({'contact_number': phone}))
+        cache_key = search_cache.key('by_phone', current_user.role, phone=phone_key(phone))
+        cached = search_cache.get(cache_key)
+        if cached:
+            return jsonify(cached)
+        
+        # Find all patients with this phone number, however it was typed
+        patients = list(mongo.db.patient.find({'phone_key': phone_key(phone)}))
+        visit_histories = get_visit_histories([patient['_id'] for patient in patients])
         
         patients_data = []
         for patient in patients:
             # Calculate age
-            try:
-                today = datetime.now()
-                if isinstance(patient['date_of_birth'], datetime):
-                    age = today.year - patient['date_of_birth'].year
-                    if today.month < patient['date_of_birth'].month or \
-                       (today.month == today.month and today.day < patient['date_of_birth'].day):
-                        age -= 1
-                else:
-                    age = 0
-            except:
-                age = 0
-
-            # Get visit history
-            try:
-                visits = list(mongo.db.visit.find({'patient_id': patient['_id']}))
-                visits.sort(key=lambda x: x.get('visit_date', x.get('_id')), reverse=True)
-
-                visit_history = []
-                for visit in visits:
-                    try:
-                        doctor = mongo.db.doctor.find_one({'_id': visit.get('doctor_id')})
-                        department = mongo.db.department.find_one({'_id': visit.get('department_id')})
-
-                        visit_date = visit.get('visit_date')
-                        if visit_date:
-                            if isinstance(visit_date, datetime):
-                                visit_date_str = visit_date.strftime('%Y-%m-%d %H:%M')
-                            else:
-                                visit_date_str = str(visit_date)
-                        else:
-                            visit_date_str = 'Date not available'
-
-                        visit_data = {
-                            'visit_id': str(visit['_id']),
-                            'visit_date_time': visit_date_str,
-                            'doctor_name': doctor['name'] if doctor else 'Unknown',
-                            'department_name': department['department_name'] if department else 'Unknown',
-                            'diagnosis': visit.get('diagnosis', ''),
-                            'medications': visit.get('medications', ''),
-                            'follow_up_date': visit['follow_up_date'].strftime('%Y-%m-%d') if visit.get('follow_up_date') else ''
-                        }
-                        visit_history.append(visit_data)
-                    except Exception as visit_error:
-                        continue
-            except:
-                visit_history = []
+            age = age_in_years(patient.get('date_of_birth'))
 
             patient_data = {
                 '_id': str(patient['_id']),
@@ -787,16 +1223,88 @@ def search_patients_by_phone():
                 'chronic_illness': patient.get('chronic_illness', ''),
                 'aadhaar_number': patient.get('aadhaar_number', ''),
                 'date_of_birth': patient['date_of_birth'],
-                'visits': visit_history
+                **visit_histories[patient['_id']]
             }
             patients_data.append(patient_data)
         
-        return jsonify({'success': True, 'patients': patients_data})
+        payload = {'success': True, 'patients': patients_data}
+        search_cache.set(cache_key, payload, [patient['_id'] for patient in patients])
+        return jsonify(payload)
         
     except Exception as e:
         print(f"Phone search error: {str(e)}")
         return jsonify({'success': False, 'message': f'Search error: {str(e)}'})
 
+app.config['FUZZY_CANDIDATE_LIMIT'] = int(os.getenv('FUZZY_CANDIDATE_LIMIT', 200))
+# Index entries read per tier before ranking, as a multiple of the candidate limit
+app.config['FUZZY_SCAN_FACTOR'] = int(os.getenv('FUZZY_SCAN_FACTOR', 5))
+app.config['FUZZY_RESULT_LIMIT'] = int(os.getenv('FUZZY_RESULT_LIMIT', 20))
+app.config['FUZZY_MIN_SCORE'] = float(os.getenv('FUZZY_MIN_SCORE', 0.35))
+
+def ranked_name_candidates(match, query_trigrams, limit):
+    """
+    Up to `limit` patients matching `match`, best trigram overlap with the
+    query first. Only limit * FUZZY_SCAN_FACTOR index matches are read and
+    ranked, so a common key never turns into a collection scan and sort.
+    """
+    return mongo.db.patient.aggregate([
+        {'$match': match},
+        {'$limit': limit * app.config['FUZZY_SCAN_FACTOR']},
+        {'$project': {
+            'name_tokens': 1,
+            'overlap': {'$size': {'$setIntersection': [{'$ifNull': ['$name_trigrams', []]}, query_trigrams]}}
+        }},
+        {'$sort': {'overlap': -1, '_id': 1}},
+        {'$limit': limit}
+    ])
+
+def find_fuzzy_patients(name):
+    """
+    Misspelling-tolerant name search. Candidates are read from the indexed
+    name_phonetic and name_trigrams keys in tiers, narrowest first: every
+    query word sounds alike, any word sounds alike, then shared trigrams.
+    Within a tier a bounded slice of index matches is ranked by trigram
+    overlap before the FUZZY_CANDIDATE_LIMIT cap; the narrow tiers come
+    first so common surnames rarely crowd out the intended match. Only that
+    small set is scored in Python.
+    Returns [(patient, score)] best first.
+    """
+    tokens = normalize_name(name).split()
+    if not tokens:
+        return []
+    
+    candidate_limit = app.config['FUZZY_CANDIDATE_LIMIT']
+    phonetic_keys = sorted({phonetic_key(token) for token in tokens} - {''})
+    query_trigrams = sorted(set().union(*(trigrams(token) for token in tokens)))
+    tiers = [{'name_phonetic': {'$in': phonetic_keys}}, {'name_trigrams': {'$in': query_trigrams}}]
+    if len(phonetic_keys) > 1:
+        tiers.insert(0, {'name_phonetic': {'$all': phonetic_keys}})
+    
+    candidates = {}
+    for match in tiers:
+        if len(candidates) >= candidate_limit:
+            break
+        if candidates:
+            match = {**match, '_id': {'$nin': list(candidates)}}
+        for patient in ranked_name_candidates(match, query_trigrams, candidate_limit - len(candidates)):
+            candidates[patient['_id']] = patient
+    
+    scored = sorted(
+        (
+            (name_similarity(name, patient.get('name_tokens', [])), patient_id)
+            for patient_id, patient in candidates.items()
+        ),
+        reverse=True
+    )
+    scored = [(score, patient_id) for score, patient_id in scored if score >= app.config['FUZZY_MIN_SCORE']]
+    scored = scored[:app.config['FUZZY_RESULT_LIMIT']]
+    
+    patients = {
+        patient['_id']: patient
+        for patient in mongo.db.patient.find({'_id': {'$in': [patient_id for _, patient_id in scored]}})
+    }
+    return [(patients[patient_id], round(score, 3)) for score, patient_id in scored if patient_id in patients]
+
 @app.route('/api/patients/by-name', methods=['POST'])
 @role_required(['admin'])
 def search_patients_by_name():
@@ -807,58 +1315,34 @@ def search_patients_by_name():
         if not name:
             return jsonify({'success': False, 'message': 'Name is required'})
         
-        # Find patients with similar names
-        patients = list(mongo.db.patient.find({'name': {'$regex': name, '$options': 'i'}}))
+        fuzzy = str(data.get('fuzzy', '')).lower() in ('true', '1', 'yes')
+        cache_key = search_cache.key('by_name', current_user.role, name=normalize_name(name), fuzzy=fuzzy)
+        cached = search_cache.get(cache_key)
+        if cached:
+            return jsonify(cached)
+        
+        if fuzzy:
+            # Ranked, misspelling-tolerant matches
+            matches = find_fuzzy_patients(name)
+        else:
+            # Patients whose full name starts with the typed phrase first (name_search index, in name order),
+            # then the rest of those whose name words start with the searched words
+            name_query = name_prefix_query(name)
+            matches = []
+            if name_query:
+                phrase_matches = list(mongo.db.patient.find(
+                    {'name_search': prefix_regex(normalize_name(name))}
+                ).sort('name_search', 1))
+                word_matches = mongo.db.patient.find(
+                    {**name_query, '_id': {'$nin': [patient['_id'] for patient in phrase_matches]}}
+                )
+                matches = [(patient, None) for patient in phrase_matches + list(word_matches)]
+        visit_histories = get_visit_histories([patient['_id'] for patient, _ in matches])
         
         patients_data = []
-        for patient in patients:
+        for patient, match_score in matches:
             # Calculate age
-            try:
-                today = datetime.now()
-                if isinstance(patient['date_of_birth'], datetime):
-                    age = today.year - patient['date_of_birth'].year
-                    if today.month < patient['date_of_birth'].month or \
-                       (today.month == today.month and today.day < patient['date_of_birth'].day):
-                        age -= 1
-                else:
-                    age = 0
-            except:
-                age = 0
-
-            # Get visit history
-            try:
-                visits = list(mongo.db.visit.find({'patient_id': patient['_id']}))
-                visits.sort(key=lambda x: x.get('visit_date', x.get('_id')), reverse=True)
-
-                visit_history = []
-                for visit in visits:
-                    try:
-                        doctor = mongo.db.doctor.find_one({'_id': visit.get('doctor_id')})
-                        department = mongo.db.department.find_one({'_id': visit.get('department_id')})
-
-                        visit_date = visit.get('visit_date')
-                        if visit_date:
-                            if isinstance(visit_date, datetime):
-                                visit_date_str = visit_date.strftime('%Y-%m-%d %H:%M')
-                            else:
-                                visit_date_str = str(visit_date)
-                        else:
-                            visit_date_str = 'Date not available'
-
-                        visit_data = {
-                            'visit_id': str(visit['_id']),
-                            'visit_date_time': visit_date_str,
-                            'doctor_name': doctor['name'] if doctor else 'Unknown',
-                            'department_name': department['department_name'] if department else 'Unknown',
-                            'diagnosis': visit.get('diagnosis', ''),
-                            'medications': visit.get('medications', ''),
-                            'follow_up_date': visit['follow_up_date'].strftime('%Y-%m-%d') if visit.get('follow_up_date') else ''
-                        }
-                        visit_history.append(visit_data)
-                    except Exception as visit_error:
-                        continue
-            except:
-                visit_history = []
+            age = age_in_years(patient.get('date_of_birth'))
 
             patient_data = {
                 '_id': str(patient['_id']),
@@ -872,16 +1356,64 @@ def search_patients_by_name():
                 'chronic_illness': patient.get('chronic_illness', ''),
                 'aadhaar_number': patient.get('aadhaar_number', ''),
                 'date_of_birth': patient['date_of_birth'],
-                'visits': visit_history
+                **visit_histories[patient['_id']]
             }
+            if match_score is not None:
+                patient_data['match_score'] = match_score
             patients_data.append(patient_data)
         
-        return jsonify({'success': True, 'patients': patients_data})
+        payload = {'success': True, 'patients': patients_data}
+        search_cache.set(cache_key, payload, [patient['_id'] for patient, _ in matches])
+        return jsonify(payload)
         
     except Exception as e:
         print(f"Name search error: {str(e)}")
         return jsonify({'success': False, 'message': f'Search error: {str(e)}'})
 
+app.config['SUGGEST_MIN_QUERY_LENGTH'] = int(os.getenv('SUGGEST_MIN_QUERY_LENGTH', 2))
+app.config['SUGGEST_MAX_AGE'] = int(os.getenv('SUGGEST_MAX_AGE', 30))
+SUGGEST_LIMIT = 10
+# Every returned field is in the suggest indexes, so MongoDB answers from the index alone
+SUGGEST_PROJECTION = {'_id': 1, 'patient_id': 1, 'name': 1, 'contact_number': 1}
+
+@app.route('/api/patients/suggest')
+@role_required(['admin'])
+def suggest_patients():
+    """Typeahead for the patient search boxes: at most 10 small tuples per keystroke"""
+    try:
+        term = request.args.get('q', '').strip()
+        suggestions = []
+        
+        query = None
+        if len(term) >= app.config['SUGGEST_MIN_QUERY_LENGTH']:
+            if re.match(r'^PT\d*$', term, re.IGNORECASE):
+                query = {'patient_id': prefix_regex(term.upper())}
+                sort = [('patient_id', 1)]
+            elif normalize_name(term):
+                # Terms that normalize to '' (punctuation only) would match every patient, so get no query
+                query = {'name_search': prefix_regex(normalize_name(term))}
+                sort = [('name_search', 1)]
+        
+        if query:
+            for patient in mongo.db.patient.find(query, SUGGEST_PROJECTION).sort(sort).limit(SUGGEST_LIMIT):
+                suggestions.append({
+                    '_id': str(patient['_id']),
+                    'patient_id': patient['patient_id'],
+                    'name': patient['name'],
+                    'phone': mask_phone(patient.get('contact_number'))
+                })
+        
+        response = jsonify({'success': True, 'suggestions': suggestions})
+        # Per-user data: browsers may reuse it briefly, shared caches must not
+        response.headers['Cache-Control'] = f"private, max-age={app.config['SUGGEST_MAX_AGE']}"
+        response.headers['Vary'] = 'Cookie, Authorization'
+        response.add_etag()
+        return response.make_conditional(request)
+        
+    except Exception as e:
+        print(f"Patient suggest error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Suggestion error occurred'})
+
 @app.route('/api/departments')
 @role_required('admin')
 def get_departments():
@@ -893,41 +1425,281 @@ def get_departments():
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error fetching departments'})
 
+@app.route('/api/admin/cache-stats')
+@role_required('admin')
+def get_cache_stats():
+    return jsonify({
+        'success': True,
+        'caches': {name: cache.stats() for name, cache in app_caches.items()}
+    })
+
+# Admin overview statistics, one $facet aggregation per collection
+def facet_count(facet):
+    return facet[0]['count'] if facet else 0
+
+def compute_admin_overview():
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    tomorrow = today + timedelta(days=1)
+    
+    doctor_stats = next(mongo.db.doctor.aggregate([{'$facet': {
+        'total': [{'$count': 'count'}],
+        'by_department': [{'$group': {'_id': '$department_id', 'count': {'$sum': 1}}}]
+    }}]))
+    
+    # Only today's visits feed the facet, so the visit_date index bounds the scan
+    visit_stats = next(mongo.db.visit.aggregate([
+        {'$match': {'visit_date': {'$gte': today, '$lt': tomorrow}}},
+        {'$facet': {
+            'total': [{'$count': 'count'}],
+            'by_status': [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}],
+            'active_doctors': [{'$group': {'_id': '$doctor_id'}}, {'$count': 'count'}]
+        }}
+    ]))
+    
+    patient_stats = next(mongo.db.patient.aggregate([{'$facet': {
+        'total': [{'$count': 'count'}],
+        'recent_registrations': [
+            {'$match': {'created_at': {'$gte': datetime.now() - timedelta(days=30)}}},
+            {'$count': 'count'}
+        ],
+        'registered_today': [{'$match': {'created_at': {'$gte': today}}}, {'$count': 'count'}],
+        'by_gender': [{'$group': {'_id': '$gender', 'count': {'$sum': 1}}}]
+    }}]))
+    
+    total_doctors = facet_count(doctor_stats['total'])
+    visits_today = facet_count(visit_stats['total'])
+    return {
+        'doctors': {
+            'total': total_doctors,
+            'active_today': facet_count(visit_stats['active_doctors']),
+            'avg_patients_per_day': round(visits_today / total_doctors, 1) if total_doctors > 0 else 0,
+            'by_department': {
+                lookup_department_name(row['_id'], 'Unassigned'): row['count'] for row in doctor_stats['by_department']
+            }
+        },
+        'departments': {
+            'total': len(reference_cache.all('departments'))
+        },
+        'visits': {
+            'today': visits_today,
+            'today_by_status': {row['_id'] or 'unknown': row['count'] for row in visit_stats['by_status']}
+        },
+        'patients': {
+            'total': facet_count(patient_stats['total']),
+            'recent_registrations': facet_count(patient_stats['recent_registrations']),
+            'registered_today': facet_count(patient_stats['registered_today']),
+            'with_visits': count_patients_with_visits(mongo.db.visit),
+            'by_gender': {row['_id'] or 'unknown': row['count'] for row in patient_stats['by_gender']}
+        },
+        'generated_at': datetime.now().isoformat()
+    }
+
+overview_lock = threading.Lock()
+
+def get_admin_overview():
+    overview = overview_cache.get('overview')
+    if overview is None:
+        # Concurrent misses wait for one computation instead of each running the aggregations
+        with overview_lock:
+            overview = overview_cache.get('overview')
+            if overview is None:
+                overview = compute_admin_overview()
+                overview_cache.set('overview', overview)
+    return overview
+
+@app.route('/api/admin/overview')
+@role_required('admin')
+def admin_overview():
+    try:
+        return jsonify({'success': True, 'overview': get_admin_overview()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error fetching overview: {str(e)}'}), 500
+
 @app.route('/api/doctors/stats')
 @role_required('admin')
 def get_doctors_stats():
     try:
-        # Get total doctors count
-        total_doctors = mongo.db.doctor.count_documents({})
-        
-        # Get total departments count
-        total_departments = mongo.db.department.count_documents({})
-        
-        # Get doctors active today (with visits today)
-        today = datetime.now().date()
-        start_of_day = datetime.combine(today, datetime.min.time())
-        end_of_day = datetime.combine(today, datetime.max.time())
-        
-        active_doctors = mongo.db.visit.distinct('doctor_id', {
-            'visit_date': {'$gte': start_of_day, '$lte': end_of_day}
-        })
-        
-        # Calculate average patients per day per doctor
-        total_visits_today = mongo.db.visit.count_documents({
-            'visit_date': {'$gte': start_of_day, '$lte': end_of_day}
-        })
-        
-        avg_patients_per_day = round(total_visits_today / total_doctors, 1) if total_doctors > 0 else 0
-        
+        overview = get_admin_overview()
         return jsonify({
-            'total_doctors': total_doctors,
-            'total_departments': total_departments,
-            'active_today': len(active_doctors),
-            'avg_patients_per_day': avg_patients_per_day
+            'total_doctors': overview['doctors']['total'],
+            'total_departments': overview['departments']['total'],
+            'active_today': overview['doctors']['active_today'],
+            'avg_patients_per_day': overview['doctors']['avg_patients_per_day']
         })
     except Exception as e:
         return jsonify({'success': False, 'message': 'Error fetching doctor stats'})
 
+# Per-doctor daily count of open visits, kept in `doctor_load` so list views skip a count per doctor.
+# database_setup.reconcile_doctor_loads rebuilds the counts from `visit` if they drift.
+ACTIVE_VISIT_STATUSES = ['assigned', 'in_progress']
+
+def adjust_doctor_load(doctor_id, visit_date, delta):
+    day = visit_date.strftime('%Y-%m-%d')
+    mongo.db.doctor_load.update_one(
+        {'doctor_id': ObjectId(doctor_id), 'date': day},
+        {'$inc': {'active': delta}},
+        upsert=True
+    )
+    if day == datetime.now().strftime('%Y-%m-%d'):
+        load_balancer.adjust(ObjectId(doctor_id), delta)
+
+def insert_assigned_visit(visit_data):
+    """Write path shared by every endpoint that assigns a patient to a doctor"""
+    result = mongo.db.visit.insert_one(visit_data)
+    search_cache.invalidate_patients([visit_data['patient_id']])
+    adjust_doctor_load(visit_data['doctor_id'], visit_data['visit_date'], 1)
+    return result
+
+def get_doctor_loads(doctor_ids):
+    """Today's open-visit count for each doctor id, in one query"""
+    loads = mongo.db.doctor_load.find(
+        {'doctor_id': {'$in': [ObjectId(doctor_id) for doctor_id in doctor_ids]},
+         'date': datetime.now().strftime('%Y-%m-%d')},
+        {'doctor_id': 1, 'active': 1}
+    )
+    return {load['doctor_id']: max(load.get('active', 0), 0) for load in loads}
+
+# Auto-assignment keeps per-department heaps of today's loads, resynced from doctor_load periodically
+app.config['AUTO_ASSIGN_RESYNC_SECONDS'] = int(os.getenv('AUTO_ASSIGN_RESYNC_SECONDS', 30))
+# Doctors with no doctor_schedule entry for today are never auto-assigned unless this is set to false
+app.config['AUTO_ASSIGN_REQUIRE_SCHEDULE'] = os.getenv('AUTO_ASSIGN_REQUIRE_SCHEDULE', 'true').lower() == 'true'
+
+def load_department_doctor_loads(department_id):
+    doctor_ids = [
+        doctor['_id'] for doctor in reference_cache.all('doctors')
+        if doctor.get('department_id') == department_id and doctor.get('is_active', True)
+    ]
+    loads = get_doctor_loads(doctor_ids)
+    return {doctor_id: loads.get(doctor_id, 0) for doctor_id in doctor_ids}
+
+load_balancer = DepartmentLoadBalancer(
+    load_department_doctor_loads, resync_interval=app.config['AUTO_ASSIGN_RESYNC_SECONDS']
+)
+app_caches['load_balancer'] = load_balancer
+
+def in_time_slot(time_slot, now):
+    """True if `now` falls inside a "HH:MM-HH:MM" doctor_schedule slot"""
+    try:
+        start, end = time_slot.split('-')
+        return start.strip() <= now.strftime('%H:%M') < end.strip()
+    except (AttributeError, ValueError):
+        return False
+
+def scheduled_doctor_check(now):
+    """Availability predicate built from today's doctor_schedule entries in one query"""
+    schedules = {
+        schedule['doctor_id']: schedule.get('time_slots', [])
+        for schedule in mongo.db.doctor_schedule.find(
+            {'date': now.strftime('%Y-%m-%d')}, {'doctor_id': 1, 'time_slots': 1}
+        )
+    }
+    require_schedule = app.config['AUTO_ASSIGN_REQUIRE_SCHEDULE']
+    
+    def is_available(doctor_id):
+        if doctor_id not in schedules:
+            return not require_schedule
+        return any(in_time_slot(slot, now) for slot in schedules[doctor_id])
+    return is_available
+
+def list_total(collection, query):
+    """
+    Total for a list endpoint, per the `total` argument: 'exact' counts, 'none'
+    skips counting, and the default uses the collection's metadata count when
+    nothing is filtered and counts otherwise. Returns (total, is_estimate).
+    """
+    mode = request.args.get('total', 'auto')
+    if mode == 'none':
+        return None, False
+    if mode != 'exact' and not query:
+        return collection.estimated_document_count(), True
+    return collection.count_documents(query), False
+
+# CSV exports stream from the cursor: one batch of documents and one chunk of text in memory at a time
+app.config['EXPORT_BATCH_SIZE'] = int(os.getenv('EXPORT_BATCH_SIZE', 1000))
+EXPORT_FLUSH_ROWS = 500
+
+def iter_csv(header, rows):
+    """Yield CSV text a few hundred rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_FLUSH_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def csv_download_response(header, rows, filename):
+    response = Response(stream_with_context(iter_csv(header, rows)), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+PATIENT_EXPORT_HEADER = [
+    'Patient ID', 'Name', 'Contact Number', 'Age', 'Gender', 
+    'Address', 'Allergies', 'Chronic Illness', 'Aadhaar Number', 
+    'Date of Birth', 'Registration Date'
+]
+PATIENT_EXPORT_PROJECTION = {
+    '_id': 0, 'patient_id': 1, 'name': 1, 'contact_number': 1, 'age': 1, 'gender': 1, 'address': 1,
+    'allergies': 1, 'chronic_illness': 1, 'aadhaar_number': 1, 'date_of_birth': 1, 'created_at': 1
+}
+
+def patient_export_row(patient):
+    # Calculate age if not present
+    age = patient.get('age') or age_in_years(patient.get('date_of_birth'))
+    
+    # Format dates
+    dob_str = ''
+    if patient.get('date_of_birth'):
+        if isinstance(patient['date_of_birth'], datetime):
+            dob_str = patient['date_of_birth'].strftime('%Y-%m-%d')
+        else:
+            dob_str = str(patient['date_of_birth'])
+    
+    reg_date_str = ''
+    if patient.get('created_at'):
+        if isinstance(patient['created_at'], datetime):
+            reg_date_str = patient['created_at'].strftime('%Y-%m-%d')
+        else:
+            reg_date_str = str(patient['created_at'])
+    
+    return [
+        patient.get('patient_id', ''),
+        patient.get('name', ''),
+        patient.get('contact_number', ''),
+        age,
+        patient.get('gender', ''),
+        patient.get('address', ''),
+        patient.get('allergies', ''),
+        patient.get('chronic_illness', ''),
+        patient.get('aadhaar_number', ''),
+        dob_str,
+        reg_date_str
+    ]
+
+DOCTOR_EXPORT_HEADER = [
+    'Name', 'Username', 'Email', 'Phone', 'Department', 
+    'Specialization', 'Room Number', 'Join Date'
+]
+DOCTOR_EXPORT_PROJECTION = {
+    '_id': 0, 'name': 1, 'username': 1, 'email': 1, 'phone': 1, 'department_id': 1,
+    'specialization': 1, 'room_no': 1, 'created_at': 1
+}
+
+def doctor_export_row(doctor):
+    return [
+        doctor['name'],
+        doctor['username'],
+        doctor.get('email', ''),
+        doctor.get('phone', ''),
+        lookup_department_name(doctor.get('department_id'), 'N/A'),
+        doctor.get('specialization', ''),
+        doctor.get('room_no', ''),
+        doctor.get('created_at', datetime.now()).strftime('%Y-%m-%d') if doctor.get('created_at') else 'N/A'
+    ]
+
 @app.route('/api/doctors/list')
 @role_required('admin')
 def get_doctors_list():
@@ -960,33 +1732,26 @@ def get_doctors_list():
         }
         sort_criteria = sort_options.get(sort_by, [('name', 1)])
         
-        # Get total count
-        total = mongo.db.doctor.count_documents(query)
+        total, total_is_estimate = list_total(mongo.db.doctor, query)
         
-        # Get paginated results
-        skip = (page - 1) * per_page
-        doctors = list(mongo.db.doctor.find(query).sort(sort_criteria).skip(skip).limit(per_page))
+        # A cursor from a previous response seeks straight to the page; `page` alone still uses skip
+        try:
+            doctors, next_cursor, prev_cursor = keyset_page(
+                mongo.db.doctor, query, sort_criteria, per_page,
+                cursor=request.args.get('cursor'), skip=(page - 1) * per_page
+            )
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
         
         # Enrich doctor data with department info and current load
-        today = datetime.now().date()
-        start_of_day = datetime.combine(today, datetime.min.time())
-        end_of_day = datetime.combine(today, datetime.max.time())
+        doctor_loads = get_doctor_loads([doctor['_id'] for doctor in doctors])
         
         doctor_list = []
         for doctor in doctors:
             # Get department name
-            department_name = 'N/A'
-            if 'department_id' in doctor:
-                dept = mongo.db.department.find_one({'_id': doctor['department_id']})
-                if dept:
-                    department_name = dept['department_name']
-            
-            # Get current patient load
-            current_load = mongo.db.visit.count_documents({
-                'doctor_id': doctor['_id'],
-                'visit_date': {'$gte': start_of_day, '$lte': end_of_day},
-                'status': {'$in': ['assigned', 'in_progress']}
-            })
+            department_name = lookup_department_name(doctor.get('department_id'), 'N/A')
+            
+            current_load = doctor_loads.get(doctor['_id'], 0)
             
             doctor_data = {
                 '_id': str(doctor['_id']),
@@ -1003,15 +1768,18 @@ def get_doctors_list():
             }
             doctor_list.append(doctor_data)
         
-        total_pages = (total + per_page - 1) // per_page
+        total_pages = (total + per_page - 1) // per_page if total is not None else None
         
         return jsonify({
             'success': True,
             'doctors': doctor_list,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page,
-            'total_pages': total_pages
+            'total_pages': total_pages,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
         })
         
     except Exception as e:
@@ -1040,7 +1808,7 @@ def register_doctor():
             return jsonify({'success': False, 'message': 'Username already exists in admin accounts'})
         
         # Hash password
-        password_hash = generate_password_hash(data['password'])
+        password_hash = password_hasher.hash(data['password'])
         
         doctor_data = {
             'name': data['name'].strip(),
@@ -1056,6 +1824,7 @@ def register_doctor():
         }
         
         result = mongo.db.doctor.insert_one(doctor_data)
+        bump_reference_version()
         
         if result.inserted_id:
             return jsonify({
@@ -1066,6 +1835,8 @@ def register_doctor():
         else:
             return jsonify({'success': False, 'message': 'Registration failed'})
             
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
     except Exception as e:
         return jsonify({'success': False, 'message': f'Registration error: {str(e)}'})
 
@@ -1078,11 +1849,7 @@ def get_doctor_details(doctor_id):
             return jsonify({'success': False, 'message': 'Doctor not found'})
         
         # Get department name
-        department_name = 'N/A'
-        if 'department_id' in doctor:
-            dept = mongo.db.department.find_one({'_id': doctor['department_id']})
-            if dept:
-                department_name = dept['department_name']
+        department_name = lookup_department_name(doctor.get('department_id'), 'N/A')
         
         doctor_data = {
             '_id': str(doctor['_id']),
@@ -1145,6 +1912,8 @@ def update_doctor(doctor_id):
             {'_id': ObjectId(doctor_id)},
             {'$set': update_data}
         )
+        invalidate_principal(doctor_id)
+        bump_reference_version()
         
         if result.modified_count > 0:
             return jsonify({'success': True, 'message': 'Doctor updated successfully'})
@@ -1170,21 +1939,26 @@ def admin_change_doctor_password(doctor_id):
             return jsonify({'success': False, 'message': 'Doctor not found'})
         
         # Update password
-        hashed_password = generate_password_hash(new_password)
+        hashed_password = password_hasher.hash(new_password)
         result = mongo.db.doctor.update_one(
             {'_id': ObjectId(doctor_id)},
-            {'$set': {
-                'password_hash': hashed_password,
-                'password': hashed_password,  # Update both fields for compatibility
-                'updated_at': datetime.now()
-            }}
+            {
+                '$set': {
+                    'password_hash': hashed_password,
+                    'updated_at': datetime.now()
+                },
+                '$unset': {'password': ''}  # Legacy duplicate of password_hash
+            }
         )
+        invalidate_principal(doctor_id)
         
         if result.modified_count > 0:
             return jsonify({'success': True, 'message': 'Password changed successfully'})
         else:
             return jsonify({'success': False, 'message': 'Failed to update password'})
             
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
     except Exception as e:
         print(f"Admin password change error: {str(e)}")
         return jsonify({'success': False, 'message': 'Error changing password'})
@@ -1194,7 +1968,7 @@ def admin_change_doctor_password(doctor_id):
 def doctor_change_password():
     try:
         data = request.get_json()
-        doctor_user_id = session.get('user_id')  # Use user_id instead of username
+        doctor_user_id = current_user.id  # Use user_id instead of username
         
         current_password = data.get('current_password')
         new_password = data.get('new_password')
@@ -1207,31 +1981,31 @@ def doctor_change_password():
             return jsonify({'success': False, 'message': 'Doctor not found'})
         
         # Check password in both possible fields
-        password_valid = False
-        if 'password_hash' in doctor and doctor['password_hash']:
-            password_valid = check_password_hash(doctor['password_hash'], current_password)
-        elif 'password' in doctor and doctor['password']:
-            password_valid = check_password_hash(doctor['password'], current_password)
-        
-        if not password_valid:
+        stored_hash = doctor.get('password_hash') or doctor.get('password')
+        if not password_hasher.verify(stored_hash, current_password):
             return jsonify({'success': False, 'message': 'Current password is incorrect'})
         
         # Update password
-        hashed_password = generate_password_hash(new_password)
+        hashed_password = password_hasher.hash(new_password)
         result = mongo.db.doctor.update_one(
             {'_id': ObjectId(doctor_user_id)},
-            {'$set': {
-                'password_hash': hashed_password,
-                'password': hashed_password,  # Update both fields for compatibility
-                'updated_at': datetime.now()
-            }}
+            {
+                '$set': {
+                    'password_hash': hashed_password,
+                    'updated_at': datetime.now()
+                },
+                '$unset': {'password': ''}  # Legacy duplicate of password_hash
+            }
         )
+        invalidate_principal(doctor_user_id)
         
         if result.modified_count > 0:
             return jsonify({'success': True, 'message': 'Password changed successfully'})
         else:
             return jsonify({'success': False, 'message': 'Failed to update password'})
             
+    except PasswordHasherBusy:
+        return jsonify({'success': False, 'message': 'Server is busy, please try again'}), 503
     except Exception as e:
         print(f"Password change error: {str(e)}")
         return jsonify({'success': False, 'message': str(e)})
@@ -1255,6 +2029,8 @@ def delete_doctor(doctor_id):
         
         # Delete the doctor
         result = mongo.db.doctor.delete_one({'_id': ObjectId(doctor_id)})
+        invalidate_principal(doctor_id)
+        bump_reference_version()
         
         if result.deleted_count > 0:
             return jsonify({'success': True, 'message': 'Doctor deleted successfully'})
@@ -1268,49 +2044,12 @@ def delete_doctor(doctor_id):
 @role_required('admin')
 def export_doctors():
     try:
-        import csv
-        import io
-        
-        # Get all doctors with department info
-        doctors = list(mongo.db.doctor.find({}))
-        
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow([
-            'Name', 'Username', 'Email', 'Phone', 'Department', 
-            'Specialization', 'Room Number', 'Join Date'
-        ])
-        
-        # Write doctor data
-        for doctor in doctors:
-            # Get department name
-            department_name = 'N/A'
-            if 'department_id' in doctor:
-                dept = mongo.db.department.find_one({'_id': doctor['department_id']})
-                if dept:
-                    department_name = dept['department_name']
-            
-            writer.writerow([
-                doctor['name'],
-                doctor['username'],
-                doctor.get('email', ''),
-                doctor.get('phone', ''),
-                department_name,
-                doctor.get('specialization', ''),
-                doctor.get('room_no', ''),
-                doctor.get('created_at', datetime.now()).strftime('%Y-%m-%d') if doctor.get('created_at') else 'N/A'
-            ])
-        
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=doctors_export_{datetime.now().strftime("%Y%m%d")}.csv'
-        
-        return response
+        doctors = mongo.db.doctor.find({}, DOCTOR_EXPORT_PROJECTION).batch_size(app.config['EXPORT_BATCH_SIZE'])
+        return csv_download_response(
+            DOCTOR_EXPORT_HEADER,
+            (doctor_export_row(doctor) for doctor in doctors),
+            f'doctors_export_{datetime.now().strftime("%Y%m%d")}.csv'
+        )
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Export error: {str(e)}'})
@@ -1324,20 +2063,12 @@ def get_doctors_by_department(department_id):
             {'_id': 1, 'name': 1, 'specialization': 1, 'room_no': 1}
         ))
         
-        # Calculate current load for each doctor
-        today = datetime.now().date()
-        start_of_day = datetime.combine(today, datetime.min.time())
-        end_of_day = datetime.combine(today, datetime.max.time())
+        # Current load for each doctor
+        doctor_loads = get_doctor_loads([doctor['_id'] for doctor in doctors])
         
         for doctor in doctors:
+            visit_count = doctor_loads.get(doctor['_id'], 0)
             doctor['_id'] = str(doctor['_id'])
-            # Count today's visits for this doctor
-            visit_count = mongo.db.visit.count_documents({
-                'doctor_id': ObjectId(doctor['_id']),
-                'visit_date': {'$gte': start_of_day, '$lte': end_of_day},
-                'status': {'$in': ['assigned', 'in_progress']}
-            })
-            
             doctor['current_load'] = visit_count
             
             if visit_count <= 3:
@@ -1367,7 +2098,7 @@ def assign_patient():
             'created_at': datetime.now()
         }
         
-        result = mongo.db.visit.insert_one(visit_data)
+        result = insert_assigned_visit(visit_data)
         
         if result.inserted_id:
             return jsonify({
@@ -1397,7 +2128,7 @@ def assign_visit():
             'created_at': datetime.now()
         }
         
-        result = mongo.db.visit.insert_one(visit_data)
+        result = insert_assigned_visit(visit_data)
         
         if result.inserted_id:
             return jsonify({
@@ -1411,6 +2142,49 @@ def assign_visit():
     except Exception as e:
         return jsonify({'success': False, 'message': 'Assignment error occurred'})
 
+@app.route('/api/visit/auto-assign', methods=['POST'])
+@role_required('admin')
+def auto_assign_visit():
+    """Assign the patient to the least-loaded doctor in the department who is on duty now"""
+    try:
+        data = request.get_json(silent=True) or {}
+        if not all(ObjectId.is_valid(data.get(field) or '') for field in ('patient_id', 'department_id')):
+            return jsonify({'success': False, 'message': 'A valid patient_id and department_id are required'}), 400
+        department_id = ObjectId(data['department_id'])
+        now = datetime.now()
+        is_available = scheduled_doctor_check(now)
+        
+        # Choose and record under the department lock so concurrent requests in this worker spread out
+        with load_balancer.lock(department_id):
+            doctor_id, load = load_balancer.least_loaded(department_id, is_available)
+            if doctor_id is None:
+                return jsonify({'success': False, 'message': 'No doctor in this department is available right now'}), 409
+            
+            visit_data = {
+                'patient_id': ObjectId(data['patient_id']),
+                'doctor_id': doctor_id,
+                'department_id': department_id,
+                'reason_for_visit': data.get('reason_for_visit', 'General consultation'),
+                'visit_date': now,
+                'status': 'assigned',
+                'created_at': now,
+                'assigned_by': 'auto'
+            }
+            result = insert_assigned_visit(visit_data)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Patient assigned to doctor successfully',
+            'visit_id': str(result.inserted_id),
+            'doctor_id': str(doctor_id),
+            'doctor_name': lookup_doctor_name(doctor_id),
+            'current_load': load + 1
+        })
+        
+    except Exception as e:
+        print(f"Auto-assign error: {str(e)}")
+        return jsonify({'success': False, 'message': 'Error assigning patient'}), 500
+
 @app.route('/api/doctor/patients')
 @role_required('doctor')
 def get_doctor_patients():
@@ -1432,17 +2206,7 @@ def get_doctor_patients():
             patient = mongo.db.patient.find_one({'_id': visit['patient_id']})
             if patient:
                 # Calculate age
-                try:
-                    today_date = datetime.now()
-                    if isinstance(patient['date_of_birth'], datetime):
-                        age = today_date.year - patient['date_of_birth'].year
-                        if today_date.month < patient['date_of_birth'].month or \
-                           (today_date.month == today_date.month and today_date.day < patient['date_of_birth'].day):
-                            age -= 1
-                    else:
-                        age = 0
-                except:
-                    age = 0
+                age = age_in_years(patient.get('date_of_birth'))
                 
                 patients.append({
                     'visit_id': str(visit['_id']),
@@ -1483,8 +2247,8 @@ def get_patient_history(patient_id):
         history = []
         for visit in visits:
             try:
-                doctor = mongo.db.doctor.find_one({'_id': visit.get('doctor_id')})
-                department = mongo.db.department.find_one({'_id': visit.get('department_id')})
+                doctor = get_doctor(visit.get('doctor_id'))
+                department = get_department(visit.get('department_id'))
                 
                 visit_data = {
                     'visit_id': str(visit['_id']),
@@ -1505,17 +2269,7 @@ def get_patient_history(patient_id):
                 continue
         
         # Calculate patient age
-        try:
-            today = datetime.now()
-            if isinstance(patient['date_of_birth'], datetime):
-                age = today.year - patient['date_of_birth'].year
-                if today.month < patient['date_of_birth'].month or \
-                   (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-                    age -= 1
-            else:
-                age = 0
-        except:
-            age = 0
+        age = age_in_years(patient.get('date_of_birth'))
         
         patient_info = {
             'patient_id': patient['patient_id'],
@@ -1548,7 +2302,7 @@ def get_prescription(visit_id):
             return jsonify({'success': False, 'message': 'Visit not found'})
         
         patient = mongo.db.patient.find_one({'_id': visit['patient_id']})
-        doctor = mongo.db.doctor.find_one({'_id': visit['doctor_id']})
+        doctor = get_doctor(visit['doctor_id'])
         
         prescription_data = {
             'visit_id': str(visit['_id']),
@@ -1589,8 +2343,8 @@ def get_visit_details(visit_id):
         
         # Get patient, doctor, and department information
         patient = mongo.db.patient.find_one({'_id': visit['patient_id']})
-        doctor = mongo.db.doctor.find_one({'_id': visit['doctor_id']})
-        department = mongo.db.department.find_one({'_id': visit['department_id']})
+        doctor = get_doctor(visit['doctor_id'])
+        department = get_department(visit['department_id'])
         
         # Get prescription details from prescription collection
         prescription = mongo.db.prescription.find_one({'visit_id': ObjectId(visit_id)})
@@ -1644,7 +2398,7 @@ def edit_prescription():
         # Create audit trail entry
         audit_entry = {
             'visit_id': ObjectId(visit_id),
-            'doctor_id': ObjectId(session['user_id']),
+            'doctor_id': ObjectId(current_user.id),
             'edited_at': datetime.now(),
             'original_data': {
                 'symptoms': current_visit.get('symptoms', ''),
@@ -1672,7 +2426,7 @@ def edit_prescription():
             'medications': data.get('medications', ''),
             'instructions': data.get('instructions', ''),
             'last_modified': datetime.now(),
-            'modified_by': ObjectId(session['user_id'])
+            'modified_by': ObjectId(current_user.id)
         }
         
         if data.get('follow_up_date'):
@@ -1682,12 +2436,13 @@ def edit_prescription():
             {'_id': ObjectId(visit_id)},
             {'$set': update_data}
         )
+        search_cache.invalidate_patients([current_visit['patient_id']])
         
         # Update prescription record if exists
         prescription_data = {
             'visit_id': ObjectId(visit_id),
             'patient_id': current_visit['patient_id'],
-            'doctor_id': ObjectId(session['user_id']),
+            'doctor_id': ObjectId(current_user.id),
             'symptoms': data.get('symptoms', ''),
             'diagnosis': data.get('diagnosis', ''),
             'medications': data.get('medications', ''),
@@ -1695,7 +2450,7 @@ def edit_prescription():
             'follow_up_date': datetime.strptime(data['follow_up_date'], '%Y-%m-%d') if data.get('follow_up_date') else None,
             'created_at': current_visit.get('created_at', datetime.now()),
             'last_modified': datetime.now(),
-            'modified_by': ObjectId(session['user_id'])
+            'modified_by': ObjectId(current_user.id)
         }
         
         mongo.db.prescription.update_one(
@@ -1721,10 +2476,9 @@ def get_prescription_audit(visit_id):
         
         audit_history = []
         for entry in audit_entries:
-            doctor = mongo.db.doctor.find_one({'_id': entry['doctor_id']})
             audit_history.append({
                 'edited_at': entry['edited_at'].strftime('%Y-%m-%d %H:%M:%S'),
-                'doctor_name': doctor['name'] if doctor else 'Unknown',
+                'doctor_name': lookup_doctor_name(entry['doctor_id']),
                 'original_data': entry['original_data'],
                 'new_data': entry['new_data']
             })
@@ -1783,7 +2537,7 @@ def get_visit_tests(visit_id):
         test_list = []
         for test in tests:
             # Get doctor info
-            doctor = mongo.db.doctor.find_one({'_id': test['doctor_id']})
+            doctor = get_doctor(test['doctor_id'])
             
             test_data = {
                 'test_id': str(test['_id']),
@@ -1814,7 +2568,7 @@ def get_patient_tests(patient_id):
         test_list = []
         for test in tests:
             # Get doctor and visit info
-            doctor = mongo.db.doctor.find_one({'_id': test['doctor_id']})
+            doctor = get_doctor(test['doctor_id'])
             visit = mongo.db.visit.find_one({'_id': test['visit_id']})
             
             test_data = {
@@ -2079,55 +2833,66 @@ def delete_test_file(test_id, file_index):
         logging.error(f"Error deleting file: {str(e)}")
         return jsonify({'success': False, 'message': f'Error deleting file: {str(e)}'})
 
+PATIENT_LIST_FILTERS = ('search', 'gender', 'created_from', 'created_to')
+
+def patient_list_query(filters):
+    """
+    Patient filter shared by the list view and export jobs: free-text search,
+    gender and an inclusive registration date range (YYYY-MM-DD).
+    Raises ValueError for malformed dates.
+    """
+    query = {}
+    search = (filters.get('search') or '').strip()
+    if search:
+        query.update(patient_lookup_query(search))
+    
+    if filters.get('gender'):
+        query['gender'] = filters['gender']
+    
+    created_range = {}
+    if filters.get('created_from'):
+        created_range['$gte'] = datetime.strptime(filters['created_from'], '%Y-%m-%d')
+    if filters.get('created_to'):
+        created_range['$lt'] = datetime.strptime(filters['created_to'], '%Y-%m-%d') + timedelta(days=1)
+    if created_range:
+        query['created_at'] = created_range
+    return query
+
+# Fields the patient list may be sorted by; anything else falls back to registration date
+PATIENT_LIST_SORTS = ('created_at', 'name', 'date_of_birth')
+
 @app.route('/api/patients/list')
 @role_required(['admin'])
 def get_patients_list():
     try:
         page = int(request.args.get('page', 1))
         per_page = int(request.args.get('per_page', 10))
-        search = request.args.get('search', '').strip()
-        gender = request.args.get('gender', '')
         sort_by = request.args.get('sort', 'created_at')
-        order = int(request.args.get('order', -1))
+        order = -1 if int(request.args.get('order', -1)) < 0 else 1
+        if sort_by not in PATIENT_LIST_SORTS:
+            sort_by = 'created_at'
         
-        # Build query
-        query = {}
-        if search:
-            search_regex = re.compile(search, re.IGNORECASE)
-            query['$or'] = [
-                {'name': search_regex},
-                {'contact_number': search_regex},
-                {'patient_id': search_regex}
-            ]
-        
-        if gender:
-            query['gender'] = gender
+        try:
+            query = patient_list_query(request.args)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}), 400
         
-        # Get total count
-        total = mongo.db.patient.count_documents(query)
+        total, total_is_estimate = list_total(mongo.db.patient, query)
         
-        # Get patients with pagination
-        skip = (page - 1) * per_page
-        patients = list(mongo.db.patient.find(query)
-                       .sort(sort_by, order)
-                       .skip(skip)
-                       .limit(per_page))
+        # A cursor from a previous response seeks straight to the page; `page` alone still uses skip
+        try:
+            patients, next_cursor, prev_cursor = keyset_page(
+                mongo.db.patient, query, [(sort_by, order)], per_page,
+                cursor=request.args.get('cursor'), skip=(page - 1) * per_page
+            )
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
         
         # Process patient data
         patients_data = []
         for patient in patients:
             # Calculate age
-            try:
-                today = datetime.now()
-                if isinstance(patient['date_of_birth'], datetime):
-                    age = today.year - patient['date_of_birth'].year
-                    if today.month < patient['date_of_birth'].month or \
-                       (today.month == today.month and today.day < patient['date_of_birth'].day):
-                        age -= 1
-                else:
-                    age = 0
-            except:
-                age = 0
+            age = age_in_years(patient.get('date_of_birth'))
             
             # Get visit count and last visit
             visit_count = mongo.db.visit.count_documents({'patient_id': patient['_id']})
@@ -2154,49 +2919,52 @@ def get_patients_list():
             patients_data.append(patient_data)
         
         # Calculate total pages
-        total_pages = (total + per_page - 1) // per_page
+        total_pages = (total + per_page - 1) // per_page if total is not None else None
         
         return jsonify({
             'success': True,
             'patients': patients_data,
             'total': total,
+            'total_is_estimate': total_is_estimate,
             'page': page,
             'per_page': per_page,
-            'total_pages': total_pages
+            'total_pages': total_pages,
+            'next_cursor': next_cursor,
+            'prev_cursor': prev_cursor
         })
         
     except Exception as e:
         print(f"Get patients list error: {str(e)}")
         return jsonify({'success': False, 'message': f'Error fetching patients: {str(e)}'})
 
+def get_age_distribution(filters):
+    """Cached age histogram, optionally narrowed by gender and registration date range"""
+    filters = {key: filters[key] for key in ('gender', 'created_from', 'created_to') if filters.get(key)}
+    # Today's date is part of the key since the age boundaries move at midnight
+    cache_key = (datetime.now().strftime('%Y-%m-%d'), tuple(sorted(filters.items())))
+    histogram = age_histogram_cache.get(cache_key)
+    if histogram is None:
+        histogram = age_histogram(mongo.db.patient, match=patient_list_query(filters))
+        age_histogram_cache.set(cache_key, histogram)
+    return histogram
+
 @app.route('/api/patients/stats')
 @role_required(['admin'])
 def get_patients_stats():
     try:
-        # Total patients
-        total_patients = mongo.db.patient.count_documents({})
-        
-        # Recent registrations (last 30 days)
-        thirty_days_ago = datetime.now() - timedelta(days=30)
-        recent_registrations = mongo.db.patient.count_documents({
-            'created_at': {'$gte': thirty_days_ago}
-        })
+        # Totals come from the cached admin overview; only the age histogram depends on the filters
+        overview = get_admin_overview()
         
-        # Patients with visits
-        patients_with_visits = mongo.db.patient.count_documents({
-            '_id': {'$in': [visit['patient_id'] for visit in mongo.db.visit.find({}, {'patient_id': 1})]}
-        })
-        
-        # Age distribution (simplified)
-        age_distribution = [
-            {'_id': 20, 'count': mongo.db.patient.count_documents({})},  # Simplified for now
-        ]
+        try:
+            age_distribution = get_age_distribution(request.args)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}), 400
         
         return jsonify({
             'success': True,
-            'total_patients': total_patients,
-            'recent_registrations': recent_registrations,
-            'patients_with_visits': patients_with_visits,
+            'total_patients': overview['patients']['total'],
+            'recent_registrations': overview['patients']['recent_registrations'],
+            'patients_with_visits': overview['patients']['with_visits'],
             'age_distribution': age_distribution
         })
         
@@ -2213,17 +2981,7 @@ def get_patient_details(patient_id):
             return jsonify({'success': False, 'message': 'Patient not found'})
         
         # Calculate age
-        try:
-            today = datetime.now()
-            if isinstance(patient['date_of_birth'], datetime):
-                age = today.year - patient['date_of_birth'].year
-                if today.month < patient['date_of_birth'].month or \
-                   (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-                    age -= 1
-                else:
-                    age = 0
-        except:
-            age = 0
+        age = age_in_years(patient.get('date_of_birth'))
         
         patient_data = {
             '_id': str(patient['_id']),
@@ -2257,8 +3015,8 @@ def get_patient_complete_history(patient_id):
         
         complete_history = []
         for visit in visits:
-            doctor = mongo.db.doctor.find_one({'_id': visit['doctor_id']})
-            department = mongo.db.department.find_one({'_id': visit['department_id']})
+            doctor = get_doctor(visit['doctor_id'])
+            department = get_department(visit['department_id'])
             
             # Get test results for this visit
             tests = list(mongo.db.tests.find({'visit_id': visit['_id']}))
@@ -2311,8 +3069,7 @@ def get_patient_summary(patient_id):
                     dob = datetime.strptime(patient['date_of_birth'], '%Y-%m-%d')
                 else:
                     dob = patient['date_of_birth']
-                today = datetime.now()
-                age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+                age = age_in_years(dob)
             except Exception as age_error:
                 print(f"Age calculation error: {age_error}")
                 age = 0
@@ -2477,13 +3234,13 @@ def record_new_visit():
             'visit_date': datetime.now(),
             'status': 'assigned',
             'created_at': datetime.now(),
-            'created_by': ObjectId(session['user_id']),
+            'created_by': ObjectId(current_user.id),
             'visit_type': data.get('visit_type', 'regular'),  # regular, follow-up, emergency
             'priority': data.get('priority', 'normal'),  # low, normal, high, urgent
             'notes': data.get('admin_notes', '')
         }
         
-        result = mongo.db.visit.insert_one(visit_data)
+        result = insert_assigned_visit(visit_data)
         
         if result.inserted_id:
             # Update patient's last visit date
@@ -2494,8 +3251,8 @@ def record_new_visit():
             
             # Create entry in patient history summary
             patient = mongo.db.patient.find_one({'_id': ObjectId(data['patient_id'])})
-            doctor = mongo.db.doctor.find_one({'_id': ObjectId(data['doctor_id'])})
-            department = mongo.db.department.find_one({'_id': ObjectId(data['department_id'])})
+            doctor = get_doctor(data['doctor_id'])
+            department = get_department(data['department_id'])
             
             history_entry = {
                 'patient_id': ObjectId(data['patient_id']),
@@ -2540,7 +3297,7 @@ def add_prescription():
         if not visit:
             return jsonify({'success': False, 'message': 'Visit not found'})
         
-        doctor_id = session.get('user_id')
+        doctor_id = current_user.id
         if not doctor_id:
             return jsonify({'success': False, 'message': 'Doctor session not found'})
         
@@ -2613,16 +3370,27 @@ def add_prescription():
             'attached_files': uploaded_files  # Store actual file info instead of just names
         }
         
-        # Update visit with prescription data
+        # Update visit with prescription data; the status filter makes closing an open visit atomic,
+        # so a double-submitted prescription only releases the doctor's load once
         result = mongo.db.visit.update_one(
-            {'_id': ObjectId(visit_id)},
+            {'_id': ObjectId(visit_id), 'status': {'$in': ACTIVE_VISIT_STATUSES}},
             {'$set': prescription_data}
         )
+        if result.modified_count == 1:
+            if visit.get('doctor_id') and visit.get('visit_date'):
+                adjust_doctor_load(visit['doctor_id'], visit['visit_date'], -1)
+        else:
+            # Already closed: just revise the prescription
+            result = mongo.db.visit.update_one(
+                {'_id': ObjectId(visit_id)},
+                {'$set': prescription_data}
+            )
+        search_cache.invalidate_patients([visit['patient_id']])
         
         # Create comprehensive prescription record for history
         patient = mongo.db.patient.find_one({'_id': ObjectId(visit['patient_id'])})
-        doctor = mongo.db.doctor.find_one({'_id': ObjectId(visit['doctor_id'])})
-        department = mongo.db.department.find_one({'_id': ObjectId(visit['department_id'])})
+        doctor = get_doctor(visit['doctor_id'])
+        department = get_department(visit['department_id'])
         
         patient_age = 0
         if patient:
@@ -2633,9 +3401,8 @@ def add_prescription():
                     if isinstance(patient['date_of_birth'], str):
                         dob = datetime.strptime(patient['date_of_birth'], '%Y-%m-%d')
                     else:
-                        dob = datetime.strptime(patient['date_of_birth'], '%Y-%m-%d') if isinstance(patient['date_of_birth'], str) else patient['date_of_birth']
-                    today = datetime.now()
-                    patient_age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+                        dob = patient['date_of_birth']
+                    patient_age = age_in_years(dob)
                 except (ValueError, TypeError):
                     patient_age = 0
         
@@ -2756,11 +3523,7 @@ def admin_patient_report():
         return redirect(url_for('admin_dashboard'))
     
     # Calculate age
-    today = datetime.now()
-    age = today.year - patient['date_of_birth'].year
-    if today.month < patient['date_of_birth'].month or \
-       (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-        age -= 1
+    age = age_in_years(patient.get('date_of_birth'))
     
     patient['age'] = age
     return render_template('patient_report.html', patient=patient)
@@ -2780,10 +3543,7 @@ def update_patient_by_id(patient_id):
         # Calculate age from date of birth
         try:
             dob = datetime.strptime(data['date_of_birth'], '%Y-%m-%d')
-            today = datetime.now()
-            age = today.year - dob.year
-            if today.month < dob.month or (today.month == dob.month and today.day < dob.day):
-                age -= 1
+            age = age_in_years(dob)
         except:
             age = 0
         
@@ -2791,6 +3551,7 @@ def update_patient_by_id(patient_id):
         update_data = {
             'name': data['name'],
             'contact_number': data['contact_number'],
+            'phone_key': phone_key(data['contact_number']),
             'aadhaar_number': data.get('aadhaar_number', ''),
             'date_of_birth': dob,
             'age': age,
@@ -2798,19 +3559,31 @@ def update_patient_by_id(patient_id):
             'address': data['address'],
             'allergies': data.get('allergies', ''),
             'chronic_illness': data.get('chronic_illness', ''),
-            'updated_at': datetime.now()
+            'updated_at': datetime.now(),
+            **name_search_keys(data['name'])
         }
         
+        update_ops = {'$set': update_data}
+        aadhaar_key_value = aadhaar_hash(update_data['aadhaar_number'])
+        if aadhaar_key_value:
+            update_data['aadhaar_hash'] = aadhaar_key_value
+        else:
+            update_ops['$unset'] = {'aadhaar_hash': ''}
+        
         result = mongo.db.patient.update_one(
             {'_id': ObjectId(patient_id)},
-            {'$set': update_data}
+            update_ops
         )
+        search_cache.invalidate_patient_write(patient_id, update_data)
         
         if result.modified_count > 0:
+            age_histogram_cache.clear()  # Date of birth or gender may have changed
             return jsonify({'success': True, 'message': 'Patient updated successfully'})
         else:
             return jsonify({'success': False, 'message': 'No changes made or patient not found'})
             
+    except DuplicateKeyError:
+        return jsonify({'success': False, 'message': 'Another patient already has this name and phone number or Aadhaar number'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating patient: {str(e)}'})
 
@@ -2833,10 +3606,7 @@ def update_patient_post():
         # Calculate age from date of birth
         try:
             dob = datetime.strptime(data['date_of_birth'], '%Y-%m-%d')
-            today = datetime.now()
-            age = today.year - dob.year
-            if today.month < dob.month or (today.month == dob.month and today.day < dob.day):
-                age -= 1
+            age = age_in_years(dob)
         except:
             age = 0
         
@@ -2844,6 +3614,7 @@ def update_patient_post():
         update_data = {
             'name': data['name'],
             'contact_number': data['contact_number'],
+            'phone_key': phone_key(data['contact_number']),
             'aadhaar_number': data.get('aadhaar_number', ''),
             'date_of_birth': dob,
             'age': age,
@@ -2851,19 +3622,31 @@ def update_patient_post():
             'address': data['address'],
             'allergies': data.get('allergies', ''),
             'chronic_illness': data.get('chronic_illness', ''),
-            'updated_at': datetime.now()
+            'updated_at': datetime.now(),
+            **name_search_keys(data['name'])
         }
         
+        update_ops = {'$set': update_data}
+        aadhaar_key_value = aadhaar_hash(update_data['aadhaar_number'])
+        if aadhaar_key_value:
+            update_data['aadhaar_hash'] = aadhaar_key_value
+        else:
+            update_ops['$unset'] = {'aadhaar_hash': ''}
+        
         result = mongo.db.patient.update_one(
             {'_id': ObjectId(patient_id)},
-            {'$set': update_data}
+            update_ops
         )
+        search_cache.invalidate_patient_write(patient_id, update_data)
         
         if result.modified_count > 0:
+            age_histogram_cache.clear()  # Date of birth or gender may have changed
             return jsonify({'success': True, 'message': 'Patient updated successfully'})
         else:
             return jsonify({'success': False, 'message': 'No changes made or patient not found'})
             
+    except DuplicateKeyError:
+        return jsonify({'success': False, 'message': 'Another patient already has this name and phone number or Aadhaar number'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error updating patient: {str(e)}'})
 
@@ -2871,78 +3654,237 @@ def update_patient_post():
 @role_required(['admin'])
 def export_patients():
     try:
-        import csv
-        import io
+        patients = mongo.db.patient.find({}, PATIENT_EXPORT_PROJECTION).batch_size(app.config['EXPORT_BATCH_SIZE'])
+        return csv_download_response(
+            PATIENT_EXPORT_HEADER,
+            (patient_export_row(patient) for patient in patients),
+            f'patients_export_{datetime.now().strftime("%Y-%m-%d")}.csv'
+        )
         
-        # Get all patients
-        patients = list(mongo.db.patient.find({}))
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Export error: {str(e)}'}), 500
+
+# Background exports: a worker thread writes a gzipped file and records progress in `jobs`.
+# Artifacts are deleted EXPORT_JOB_RETENTION_HOURS after completion by a janitor thread (start_export_janitor)
+# that runs every EXPORT_CLEANUP_INTERVAL seconds; it also fails jobs not updated for
+# EXPORT_JOB_STALE_MINUTES (e.g. the worker restarted). Records get `purge_at` only once they
+# no longer own a file; a TTL index removes them.
+app.config['EXPORT_FOLDER'] = os.getenv('EXPORT_FOLDER', 'uploads/exports')
+app.config['EXPORT_JOB_WORKERS'] = int(os.getenv('EXPORT_JOB_WORKERS', 1))
+app.config['EXPORT_JOB_RETENTION_HOURS'] = int(os.getenv('EXPORT_JOB_RETENTION_HOURS', 24))
+app.config['EXPORT_CLEANUP_INTERVAL'] = int(os.getenv('EXPORT_CLEANUP_INTERVAL', 600))
+app.config['EXPORT_JOB_STALE_MINUTES'] = int(os.getenv('EXPORT_JOB_STALE_MINUTES', 30))
+EXPORT_PROGRESS_ROWS = 5000
+EXPORT_PURGE_DELAY = timedelta(days=7)
+EXPORT_FORMATS = {'csv': 'csv.gz', 'ndjson': 'ndjson.gz'}
+os.makedirs(app.config['EXPORT_FOLDER'], exist_ok=True)
+export_executor = ThreadPoolExecutor(max_workers=app.config['EXPORT_JOB_WORKERS'], thread_name_prefix='export')
+
+def export_job_path(job):
+    return os.path.join(app.config['EXPORT_FOLDER'], f"{job['_id']}.{EXPORT_FORMATS[job['format']]}")
+
+def remove_export_file(path):
+    """Delete an export file; returns False if it exists but could not be removed"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logging.error(f"Error removing export file {path}: {e}")
+        return False
+    return True
+
+def cleanup_expired_exports():
+    """Delete artifacts past their expiry and fail jobs whose worker stopped updating them"""
+    now = datetime.now()
+    for job in mongo.db.jobs.find({'status': 'completed', 'expires_at': {'$lt': now}}, {'format': 1}):
+        if remove_export_file(export_job_path(job)):
+            mongo.db.jobs.update_one({'_id': job['_id'], 'status': 'completed'}, {'$set': {
+                'status': 'expired', 'purge_at': now + EXPORT_PURGE_DELAY
+            }})
+    
+    stale_before = now - timedelta(minutes=app.config['EXPORT_JOB_STALE_MINUTES'])
+    stale_query = {'status': {'$in': ['queued', 'running']}, '$or': [
+        {'updated_at': {'$lt': stale_before}},
+        {'updated_at': {'$exists': False}, 'created_at': {'$lt': stale_before}}
+    ]}
+    for job in mongo.db.jobs.find(stale_query, {'format': 1}):
+        result = mongo.db.jobs.update_one({'_id': job['_id'], **stale_query}, {'$set': {
+            'status': 'failed', 'error': 'Export was interrupted', 'finished_at': now,
+            'purge_at': now + EXPORT_PURGE_DELAY
+        }})
+        if result.modified_count:
+            remove_export_file(export_job_path(job) + '.part')
+
+def export_janitor():
+    while True:
+        try:
+            cleanup_expired_exports()
+        except Exception as e:
+            logging.error(f"Export cleanup failed: {e}")
+        time.sleep(app.config['EXPORT_CLEANUP_INTERVAL'])
+
+def start_export_janitor():
+    """
+    Start the cleanup thread in a serving process. Not started on import so
+    scripts and tools that import the app don't spawn it; WSGI entry points
+    should call this once. The first pass runs immediately, failing jobs
+    orphaned by a restart.
+    """
+    threading.Thread(target=export_janitor, name='export-janitor', daemon=True).start()
+
+def run_patient_export(job_id):
+    job = mongo.db.jobs.find_one({'_id': job_id})
+    path = export_job_path(job)
+    partial_path = path + '.part'
+    try:
+        started_at = datetime.now()
+        claimed = mongo.db.jobs.update_one({'_id': job_id, 'status': 'queued'}, {'$set': {
+            'status': 'running', 'started_at': started_at, 'updated_at': started_at
+        }})
+        if not claimed.modified_count:
+            # Already failed as stale by the janitor while waiting in the queue
+            return
         
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
+        query = patient_list_query(job['filters'])
+        total = mongo.db.patient.count_documents(query)
+        mongo.db.jobs.update_one({'_id': job_id}, {'$set': {'total_rows': total}})
+        
+        patients = mongo.db.patient.find(query, PATIENT_EXPORT_PROJECTION).sort('_id', 1).batch_size(app.config['EXPORT_BATCH_SIZE'])
+        rows = (patient_export_row(patient) for patient in patients)
+        rows_written = 0
+        with gzip.open(partial_path, 'wt', encoding='utf-8', newline='') as artifact:
+            if job['format'] == 'csv':
+                writer = csv.writer(artifact)
+                writer.writerow(PATIENT_EXPORT_HEADER)
+                write_row = writer.writerow
+            else:
+                write_row = lambda row: artifact.write(json.dumps(dict(zip(PATIENT_EXPORT_HEADER, row))) + '\n')
+            for row in rows:
+                write_row(row)
+                rows_written += 1
+                if rows_written % EXPORT_PROGRESS_ROWS == 0:
+                    mongo.db.jobs.update_one({'_id': job_id}, {'$set': {
+                        'rows_written': rows_written, 'updated_at': datetime.now()
+                    }})
+        os.replace(partial_path, path)
+        
+        finished_at = datetime.now()
+        result = mongo.db.jobs.update_one({'_id': job_id, 'status': 'running'}, {'$set': {
+            'status': 'completed',
+            'rows_written': rows_written,
+            'file_size': os.path.getsize(path),
+            'finished_at': finished_at,
+            'updated_at': finished_at,
+            'expires_at': finished_at + timedelta(hours=app.config['EXPORT_JOB_RETENTION_HOURS'])
+        }})
+        if not result.modified_count:
+            # The janitor already failed this job as stale; nothing will ever expire the file
+            remove_export_file(path)
+    except Exception as e:
+        logging.error(f"Export job {job_id} failed: {e}")
+        remove_export_file(partial_path)
+        finished_at = datetime.now()
+        mongo.db.jobs.update_one({'_id': job_id}, {'$set': {
+            'status': 'failed', 'error': str(e), 'finished_at': finished_at,
+            'purge_at': finished_at + EXPORT_PURGE_DELAY
+        }})
+
+def format_export_job(job):
+    job_data = {
+        'job_id': str(job['_id']),
+        'status': job['status'],
+        'format': job['format'],
+        'filters': job['filters'],
+        'rows_written': job.get('rows_written', 0),
+        'total_rows': job.get('total_rows'),
+        'created_at': job['created_at'].isoformat(),
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None,
+        'expires_at': job['expires_at'].isoformat() if job.get('expires_at') else None,
+        'error': job.get('error')
+    }
+    if job['status'] == 'completed':
+        job_data['file_size'] = job.get('file_size')
+        job_data['download_url'] = url_for('download_export_job', job_id=job_data['job_id'])
+    return job_data
+
+@app.route('/api/exports/patients', methods=['POST'])
+@role_required('admin')
+def create_patient_export_job():
+    try:
+        data = request.get_json(silent=True) or {}
+        file_format = data.get('format', 'csv')
+        if file_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': 'Format must be csv or ndjson'}), 400
         
-        # Write header
-        writer.writerow([
-            'Patient ID', 'Name', 'Contact Number', 'Age', 'Gender', 
-            'Address', 'Allergies', 'Chronic Illness', 'Aadhaar Number', 
-            'Date of Birth', 'Registration Date'
-        ])
+        filters = {key: data[key] for key in PATIENT_LIST_FILTERS if data.get(key)}
+        try:
+            patient_list_query(filters)
+        except ValueError:
+            return jsonify({'success': False, 'message': 'Dates must be in YYYY-MM-DD format'}), 400
+        
+        job = {
+            'type': 'patient_export',
+            'status': 'queued',
+            'format': file_format,
+            'filters': filters,
+            'created_by': ObjectId(current_user.id),
+            'created_at': datetime.now()
+        }
+        job['updated_at'] = job['created_at']
+        job['_id'] = mongo.db.jobs.insert_one(job).inserted_id
+        export_executor.submit(run_patient_export, job['_id'])
         
-        # Write patient data
-        for patient in patients:
-            # Calculate age if not present
-            age = patient.get('age', 0)
-            if not age and patient.get('date_of_birth'):
-                try:
-                    if isinstance(patient['date_of_birth'], datetime):
-                        today = datetime.now()
-                        age = today.year - patient['date_of_birth'].year
-                        if today.month < patient['date_of_birth'].month or \
-                           (today.month == patient['date_of_birth'].month and today.day < patient['date_of_birth'].day):
-                            age -= 1
-                except:
-                    age = 0
-            
-            # Format dates
-            dob_str = ''
-            if patient.get('date_of_birth'):
-                if isinstance(patient['date_of_birth'], datetime):
-                    dob_str = patient['date_of_birth'].strftime('%Y-%m-%d')
-                else:
-                    dob_str = str(patient['date_of_birth'])
-            
-            reg_date_str = ''
-            if patient.get('created_at'):
-                if isinstance(patient['created_at'], datetime):
-                    reg_date_str = patient['created_at'].strftime('%Y-%m-%d')
-                else:
-                    reg_date_str = str(patient['created_at'])
-            
-            writer.writerow([
-                patient.get('patient_id', ''),
-                patient.get('name', ''),
-                patient.get('contact_number', ''),
-                age,
-                patient.get('gender', ''),
-                patient.get('address', ''),
-                patient.get('allergies', ''),
-                patient.get('chronic_illness', ''),
-                patient.get('aadhaar_number', ''),
-                dob_str,
-                reg_date_str
-            ])
-        
-        # Create response
-        output.seek(0)
-        response = make_response(output.getvalue())
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=patients_export_{datetime.now().strftime("%Y-%m-%d")}.csv'
-        
-        return response
+        return jsonify({'success': True, 'job': format_export_job(job)}), 202
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'Export error: {str(e)}'}), 500
 
+@app.route('/api/exports')
+@role_required('admin')
+def list_export_jobs():
+    try:
+        jobs = mongo.db.jobs.find(
+            {'type': 'patient_export', 'created_by': ObjectId(current_user.id)}
+        ).sort('created_at', -1).limit(20)
+        return jsonify({'success': True, 'jobs': [format_export_job(job) for job in jobs]})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error fetching export jobs: {str(e)}'}), 500
+
+@app.route('/api/exports/<job_id>')
+@role_required('admin')
+def get_export_job(job_id):
+    try:
+        if not ObjectId.is_valid(job_id):
+            return jsonify({'success': False, 'message': 'Export job not found'}), 404
+        job = mongo.db.jobs.find_one({'_id': ObjectId(job_id), 'type': 'patient_export'})
+        if not job:
+            return jsonify({'success': False, 'message': 'Export job not found'}), 404
+        return jsonify({'success': True, 'job': format_export_job(job)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error fetching export job: {str(e)}'}), 500
+
+@app.route('/api/exports/<job_id>/download')
+@role_required('admin')
+def download_export_job(job_id):
+    if not ObjectId.is_valid(job_id):
+        return jsonify({'success': False, 'message': 'Export job not found'}), 404
+    job = mongo.db.jobs.find_one({'_id': ObjectId(job_id), 'type': 'patient_export'})
+    if not job:
+        return jsonify({'success': False, 'message': 'Export job not found'}), 404
+    if job['status'] != 'completed' or job['expires_at'] < datetime.now():
+        return jsonify({'success': False, 'message': f"Export is {job['status']}"}), 409
+    
+    path = export_job_path(job)
+    if not os.path.exists(path):
+        return jsonify({'success': False, 'message': 'Export file no longer available'}), 410
+    return send_file(
+        os.path.abspath(path),
+        mimetype='application/gzip',
+        as_attachment=True,
+        download_name=f"patients_export_{job['created_at'].strftime('%Y-%m-%d')}.{EXPORT_FORMATS[job['format']]}"
+    )
+
 @app.route('/doctor/profile')
 @role_required('doctor')
 def doctor_profile():
@@ -2953,7 +3895,7 @@ def doctor_profile():
 def get_doctor_profile():
     try:
         doctor_username = session.get('username')
-        user_id = session.get('user_id')
+        user_id = current_user.id
         
         print(f"[DEBUG] Session data - username: {doctor_username}, user_id: {user_id}")
         
@@ -3004,6 +3946,7 @@ def get_doctor_profile():
             
             # Insert default doctor and get the ID
             result = mongo.db.doctor.insert_one(default_doctor)
+            bump_reference_version()
             doctor = mongo.db.doctor.find_one({'_id': result.inserted_id})
             
             # Update session with new doctor ID
@@ -3011,15 +3954,7 @@ def get_doctor_profile():
             print(f"[DEBUG] Created default doctor with ID: {result.inserted_id}")
         
         # Get department info
-        department = None
-        if doctor.get('department_id'):
-            try:
-                if isinstance(doctor['department_id'], str):
-                    department = mongo.db.department.find_one({'_id': ObjectId(doctor['department_id'])})
-                else:
-                    department = mongo.db.department.find_one({'_id': doctor['department_id']})
-            except Exception as dept_error:
-                print(f"[DEBUG] Department lookup error: {dept_error}")
+        department = get_department(doctor.get('department_id'))
         
         total_patients = 0
         try:
@@ -3071,6 +4006,9 @@ def update_visit_prescription_image():
         )
         
         if result.modified_count > 0:
+            visit = mongo.db.visit.find_one({'_id': ObjectId(visit_id)}, {'patient_id': 1})
+            if visit:
+                search_cache.invalidate_patients([visit['patient_id']])
             return jsonify({'success': True, 'message': 'Prescription image updated'})
         else:
             return jsonify({'success': False, 'message': 'Visit not found or not updated'})
@@ -3083,7 +4021,7 @@ def update_visit_prescription_image():
 @role_required('doctor')
 def get_doctor_statistics():
     try:
-        doctor_user_id = session.get('user_id')
+        doctor_user_id = current_user.id
         doctor = mongo.db.doctor.find_one({'_id': ObjectId(doctor_user_id)})
         
         if not doctor:
@@ -3149,7 +4087,7 @@ def get_doctor_statistics():
 @role_required('doctor')
 def doctor_schedule():
     try:
-        doctor_user_id = session.get('user_id')
+        doctor_user_id = current_user.id
         doctor = mongo.db.doctor.find_one({'_id': ObjectId(doctor_user_id)})
         
         if not doctor:
@@ -3294,6 +4232,8 @@ def update_doctor_profile():
             {'username': doctor_username},
             {'$set': update_data}
         )
+        invalidate_principal(current_user.id)
+        bump_reference_version()
         
         if result.modified_count > 0:
             # Update session username if it was changed
@@ -3310,4 +4250,7 @@ def update_doctor_profile():
 # The first instance at line 1113 is kept as it uses user_id which is more reliable
 
 if __name__ == '__main__':
+    # The reloader re-runs this file in a child process; only that serving process starts the janitor
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_export_janitor()
     app.run(debug=True)
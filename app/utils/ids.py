@@ -0,0 +1,63 @@
+# app/utils/ids.py
+import threading
+from pymongo import ReturnDocument
+
+
+def seed_counter(counters, name, value):
+    """Raise counter `name` to at least `value`; never moves it backwards"""
+    counters.update_one({'_id': name}, {'$max': {'seq': int(value)}}, upsert=True)
+
+
+class SequenceAllocator:
+    """
+    Hands out increasing integers from a counter document advanced with an
+    atomic $inc, so concurrent workers never get the same value. `counters`
+    returns the collection; it is a callable so the allocator can be built
+    before the database is bound.
+
+    With block_size > 1 each process reserves that many values per round trip
+    and serves them from memory. Values stay unique but are only roughly
+    ordered across workers, and an unused block is skipped on restart.
+
+    `seed`, if given, returns the highest value already in use; it is applied
+    once per process before the first allocation so the counter starts above
+    existing data.
+    """
+
+    def __init__(self, counters, name, block_size=1, seed=None):
+        self.counters = counters
+        self.name = name
+        self.block_size = max(1, int(block_size))
+        self.seed = seed
+        self._seeded = seed is None
+        self._next = 1
+        self._limit = 0
+        self._lock = threading.Lock()
+
+    def _reserve(self, count):
+        """Advance the shared counter by `count`; returns the last value reserved"""
+        if not self._seeded:
+            seed_counter(self.counters(), self.name, self.seed() or 0)
+            self._seeded = True
+        counter = self.counters().find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'seq': count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter['seq']
+
+    def allocate(self, count):
+        """Reserve `count` consecutive values in one round trip, e.g. for a bulk insert"""
+        with self._lock:
+            last = self._reserve(count)
+        return range(last - count + 1, last + 1)
+
+    def next(self):
+        with self._lock:
+            if self._next > self._limit:
+                self._limit = self._reserve(self.block_size)
+                self._next = self._limit - self.block_size + 1
+            value = self._next
+            self._next += 1
+            return value
@@ -0,0 +1,98 @@
+# app/utils/load_balancer.py
+import heapq
+import itertools
+import threading
+import time
+from datetime import date
+
+_REMOVED = object()
+
+
+class DepartmentLoadBalancer:
+    """
+    Per-department min-heaps of doctors keyed by their open-visit load, so the
+    least-loaded doctor is found in O(log n). `loader(department_id)` returns
+    {doctor_id: load} for the department; a heap is rebuilt from it on first
+    use, at midnight and every `resync_interval` seconds (to pick up visits
+    written by other workers and doctor changes). In between, `adjust` keeps
+    it current for this process's own visit writes.
+
+    Load changes push a fresh entry and mark the old one removed instead of
+    re-heapifying; equal loads come out in the order they were last touched,
+    so ties rotate between doctors.
+    """
+
+    def __init__(self, loader, resync_interval=30):
+        self.loader = loader
+        self.resync_interval = resync_interval
+        self._heaps = {}
+        self._entries = {}
+        self._departments = {}
+        self._synced = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._counter = itertools.count()
+
+    def lock(self, department_id):
+        """Re-entrant lock for one department; hold it across choosing a doctor and recording the visit"""
+        with self._locks_guard:
+            return self._locks.setdefault(department_id, threading.RLock())
+
+    def _push(self, department_id, doctor_id, load):
+        entry = [load, next(self._counter), doctor_id]
+        self._entries[doctor_id] = entry
+        self._departments[doctor_id] = department_id
+        heapq.heappush(self._heaps[department_id], entry)
+
+    def _sync(self, department_id):
+        synced_day, synced_at = self._synced.get(department_id, (None, float('-inf')))
+        if synced_day == date.today() and time.monotonic() - synced_at < self.resync_interval:
+            return
+        loads = self.loader(department_id)
+        for doctor_id, entry in list(self._entries.items()):
+            if self._departments.get(doctor_id) == department_id:
+                entry[2] = _REMOVED
+                del self._entries[doctor_id]
+                del self._departments[doctor_id]
+        self._heaps[department_id] = []
+        for doctor_id, load in loads.items():
+            self._push(department_id, doctor_id, load)
+        self._synced[department_id] = (date.today(), time.monotonic())
+
+    def least_loaded(self, department_id, is_available=lambda doctor_id: True):
+        """Return (doctor_id, load) for the least-loaded available doctor, or (None, None)"""
+        with self.lock(department_id):
+            self._sync(department_id)
+            heap = self._heaps[department_id]
+            skipped = []
+            try:
+                while heap:
+                    entry = heapq.heappop(heap)
+                    if entry[2] is _REMOVED:
+                        continue
+                    skipped.append(entry)
+                    if is_available(entry[2]):
+                        return entry[2], entry[0]
+                return None, None
+            finally:
+                for entry in skipped:
+                    heapq.heappush(heap, entry)
+
+    def adjust(self, doctor_id, delta):
+        """Apply a load change for a doctor this balancer tracks; others are ignored"""
+        department_id = self._departments.get(doctor_id)
+        if department_id is None:
+            return
+        with self.lock(department_id):
+            entry = self._entries.get(doctor_id)
+            if entry is None:
+                return
+            entry[2] = _REMOVED
+            self._push(department_id, doctor_id, max(entry[0] + delta, 0))
+
+    def stats(self):
+        return {
+            'departments': len(self._heaps),
+            'doctors': len(self._entries),
+            'resync_interval': self.resync_interval
+        }
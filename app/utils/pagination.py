@@ -0,0 +1,102 @@
+# app/utils/pagination.py
+import base64
+import binascii
+from bson import json_util
+
+
+def encode_cursor(values):
+    """Opaque URL-safe token for the sort-key values of the last row on a page"""
+    raw = json_util.dumps(list(values)).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(token, length=None):
+    """
+    Inverse of encode_cursor; raises ValueError for tampered or truncated
+    tokens, including ones that do not hold exactly `length` values when given
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json_util.loads(raw.decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def keyset_filter(sort_keys, values):
+    """
+    Filter selecting documents that come strictly after `values` in the order
+    given by `sort_keys` ([(field, 1 or -1), ...]). The last key should be
+    unique (normally `_id`) so no row is skipped or repeated between pages.
+    Missing and null values sort before everything else, as MongoDB orders
+    them, even though $gt/$lt never match them.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort_keys):
+        clause = {f: v for (f, _), v in zip(sort_keys[:i], values[:i])}
+        value = values[i]
+        if direction > 0:
+            clause[field] = {'$ne': None} if value is None else {'$gt': value}
+        elif value is None:
+            # Nothing sorts below null, so no row follows it in descending order
+            continue
+        else:
+            clause['$or'] = [{field: {'$lt': value}}, {field: None}]
+        clauses.append(clause)
+    if not clauses:
+        return {'_id': {'$exists': False}}
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def keyset_page(collection, query, sort_keys, limit, cursor=None, skip=0, projection=None):
+    """
+    One page of `collection` in `sort_keys` order plus opaque tokens for the
+    neighbouring pages: returns (docs, next_cursor, prev_cursor), a token being
+    None when there is nothing in that direction. `_id` is appended as a
+    tie-breaker when missing. With a cursor the page is read from an index seek
+    instead of `skip`; `skip` remains for callers still paging by number.
+    Tokens carry the sort they were issued for, so a cursor reused with a
+    different sort raises ValueError like any other invalid cursor.
+    """
+    sort_keys = list(sort_keys)
+    if all(field != '_id' for field, _ in sort_keys):
+        sort_keys.append(('_id', sort_keys[-1][1] if sort_keys else 1))
+    fields = [field for field, _ in sort_keys]
+    spec = [[field, direction] for field, direction in sort_keys]
+
+    backwards = False
+    find_sort = sort_keys
+    if cursor:
+        values = decode_cursor(cursor, len(sort_keys) + 2)
+        if values[0] not in ('next', 'prev') or values[1] != spec:
+            raise ValueError('Invalid cursor')
+        backwards = values[0] == 'prev'
+        if backwards:
+            find_sort = [(field, -direction) for field, direction in sort_keys]
+        after = keyset_filter(find_sort, values[2:])
+        query = {'$and': [query, after]} if query else after
+        skip = 0
+
+    docs = list(collection.find(query, projection).sort(find_sort).skip(skip).limit(limit + 1))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+    if backwards:
+        docs.reverse()
+
+    def token(direction, doc):
+        return encode_cursor([direction, spec] + [_field_value(doc, field) for field in fields])
+
+    # Coming back from a later page means there is always a next page, and vice versa
+    more_after = has_more if not backwards else bool(cursor)
+    more_before = has_more if backwards else bool(cursor or skip)
+    next_cursor = token('next', docs[-1]) if docs and more_after else None
+    prev_cursor = token('prev', docs[0]) if docs and more_before else None
+    return docs, next_cursor, prev_cursor
+
+
+def _field_value(doc, field):
+    for part in field.split('.'):
+        doc = doc.get(part) if isinstance(doc, dict) else None
+    return doc
@@ -0,0 +1,75 @@
+# app/utils/passwords.py
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+def _expand_method(method):
+    """
+    The method string werkzeug stores in front of a hash made with `method`,
+    with its defaults filled in ("scrypt" -> "scrypt:32768:8:1"), worked out
+    without running the KDF
+    """
+    name, *args = method.split(':')
+    if name == 'scrypt' and not args:
+        args = [str(2 ** 15), '8', '1']
+    elif name == 'pbkdf2':
+        args = args or ['sha256']
+        if len(args) == 1:
+            args.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join([name] + args)
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing queue is full and the request should be retried"""
+
+
+class PasswordHasher:
+    """
+    Runs the password KDF in a small process pool so CPU-bound hashing does not
+    hold request threads. At most `workers + max_pending` jobs are in flight;
+    beyond that callers get PasswordHasherBusy instead of queueing forever.
+    """
+
+    def __init__(self, method='pbkdf2:sha256:600000', workers=2, max_pending=32, timeout=30):
+        self.method = method
+        self._prefix = _expand_method(method)
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily so the pool forks after the app has finished importing
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy('Password hashing queue is full')
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+            return future.result(timeout=self.timeout)
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method)
+
+    def verify(self, password_hash, password):
+        if not password_hash or not password:
+            return False
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the stored hash was made with a different method or cost"""
+        return password_hash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
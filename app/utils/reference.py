@@ -0,0 +1,71 @@
+# app/utils/reference.py
+import logging
+import threading
+import time
+
+
+class ReferenceCache:
+    """
+    Process-local snapshot of small, rarely changing collections (departments,
+    doctors). `load_data()` builds the snapshot and `load_version()` reads a
+    shared version number that writers bump. The version is checked at most
+    once per `refresh_interval` seconds and the snapshot is only reloaded when
+    it changed, so lookups normally stay off the database.
+    """
+
+    def __init__(self, load_data, load_version, refresh_interval=30, miss_check_interval=1):
+        self.load_data = load_data
+        self.load_version = load_version
+        self.refresh_interval = refresh_interval
+        self.miss_check_interval = miss_check_interval
+        self._data = None
+        self._version = None
+        self._checked_at = float('-inf')
+        self._lock = threading.Lock()
+        self.reloads = 0
+
+    def _snapshot(self, max_age):
+        data = self._data
+        if data is not None and time.monotonic() - self._checked_at < max_age:
+            return data
+        with self._lock:
+            if self._data is not None and time.monotonic() - self._checked_at < max_age:
+                return self._data
+            try:
+                version = self.load_version()
+                if self._data is None or version != self._version:
+                    self._data = self.load_data()
+                    self._version = version
+                    self.reloads += 1
+            except Exception as e:
+                if self._data is None:
+                    raise
+                # Keep serving the last snapshot rather than failing every lookup
+                logging.error(f"Reference data refresh failed: {e}")
+            self._checked_at = time.monotonic()
+            return self._data
+
+    def get(self, section, key):
+        value = self._snapshot(self.refresh_interval)[section].get(key)
+        if value is None:
+            # Possibly created by another worker since our last check
+            value = self._snapshot(self.miss_check_interval)[section].get(key)
+        return value
+
+    def all(self, section):
+        return list(self._snapshot(self.refresh_interval)[section].values())
+
+    def invalidate(self):
+        """Reload on next access; call after this process writes reference data"""
+        with self._lock:
+            self._data = None
+
+    def stats(self):
+        data = self._data
+        return {
+            'version': self._version,
+            'loaded': data is not None,
+            'sizes': {section: len(rows) for section, rows in (data or {}).items()},
+            'reloads': self.reloads,
+            'refresh_interval': self.refresh_interval
+        }
@@ -0,0 +1,181 @@
+# app/utils/search.py
+import hashlib
+import hmac
+import re
+import unicodedata
+
+
+# Derived lookup fields stored on patient documents; never part of API responses
+SEARCH_KEY_FIELDS = ('name_search', 'name_tokens', 'name_phonetic', 'name_trigrams', 'phone_key', 'aadhaar_hash')
+
+
+def normalize_name(name):
+    """
+    Lowercase a name and reduce it to letters/digits separated by single spaces.
+    Combining marks are kept so Indic vowel signs stay attached to their letters.
+    """
+    text = unicodedata.normalize('NFKC', name or '').casefold()
+    cleaned = ''.join(ch if unicodedata.category(ch)[0] in 'LNM' else ' ' for ch in text)
+    return ' '.join(cleaned.split())
+
+
+# Romanized spellings that sound alike in Indian names, applied in order
+_PHONETIC_REWRITES = [
+    ('ksh', 'ks'), ('x', 'ks'), ('chh', 'C'), ('ch', 'C'), ('ph', 'f'),
+    ('sh', 's'), ('th', 't'), ('dh', 'd'), ('bh', 'b'), ('kh', 'k'),
+    ('gh', 'g'), ('jh', 'j'), ('ck', 'k'), ('c', 'k'), ('C', 'c'),
+    ('q', 'k'), ('z', 'j'), ('w', 'v'), ('y', 'i')
+]
+
+
+def phonetic_key(token):
+    """
+    Metaphone-style key tuned for romanized Indian names: aspirates and common
+    transliteration variants are folded, vowels after the first letter dropped
+    and repeats collapsed, so "Lakshmi"/"Laxmi" -> "lksm" and
+    "Mohammed"/"Muhammad" -> "mhmd". Non-Latin tokens are returned unchanged.
+    """
+    if not token.isascii():
+        return token
+    text = re.sub(r'[^a-z]', '', token.lower())
+    if not text:
+        return ''
+    for source, target in _PHONETIC_REWRITES:
+        text = text.replace(source, target)
+
+    first = 'a' if text[0] in 'aeiou' else text[0]
+    rest = re.sub(r'[aeiou]', '', text[1:])
+    return re.sub(r'(.)\1+', r'\1', first + rest)
+
+
+def trigrams(token):
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def name_search_keys(name):
+    """Fields stored on a patient so exact, prefix and fuzzy name lookups are index-bound"""
+    normalized = normalize_name(name)
+    tokens = sorted(set(normalized.split()))
+    return {
+        'name_search': normalized,
+        'name_tokens': tokens,
+        'name_phonetic': sorted({phonetic_key(token) for token in tokens} - {''}),
+        'name_trigrams': sorted(set().union(*(trigrams(token) for token in tokens)))
+    }
+
+
+def name_similarity(query, candidate_tokens):
+    """
+    Score in [0, 1]: for each query word take its best match among the
+    candidate's words (trigram Jaccard, or 0.85 when they sound alike) and
+    average over the query words.
+    """
+    query_tokens = normalize_name(query).split()
+    if not query_tokens or not candidate_tokens:
+        return 0.0
+
+    total = 0.0
+    for query_token in query_tokens:
+        query_grams = trigrams(query_token)
+        query_key = phonetic_key(query_token)
+        best = 0.0
+        for token in candidate_tokens:
+            grams = trigrams(token)
+            score = len(query_grams & grams) / len(query_grams | grams)
+            if query_key and query_key == phonetic_key(token):
+                score = max(score, 0.85)
+            best = max(best, score)
+        total += best
+    return total / len(query_tokens)
+
+
+def phone_key(number, default_country_code='91'):
+    """
+    Canonical E.164-style key for a phone number so "+91 98765 43210",
+    "9876543210" and "098765-43210" all map to "+919876543210".
+    """
+    raw = str(number or '').strip()
+    digits = re.sub(r'\D', '', raw)
+    if not digits:
+        return ''
+    if raw.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+
+    digits = digits.lstrip('0')  # Domestic trunk prefix
+    if len(digits) == 10:
+        return f"+{default_country_code}{digits}"
+    return '+' + digits
+
+
+def phone_prefix_key(term, default_country_code='91'):
+    """
+    Start of the phone_key a partially typed number belongs to, so "98765",
+    "098765" and "+91 98765" all become "+9198765". Returns '' unless `term`
+    looks like a phone number (digits with spaces, dashes, dots, brackets, +).
+    """
+    raw = str(term or '').strip()
+    if not re.fullmatch(r'[\d\s().+-]*\d[\d\s().+-]*', raw):
+        return ''
+    digits = re.sub(r'\D', '', raw)
+    if raw.startswith('+'):
+        return '+' + digits
+    if digits.startswith('00'):
+        return '+' + digits[2:]
+
+    digits = digits.lstrip('0')  # Domestic trunk prefix
+    if len(digits) <= 10:
+        return f"+{default_country_code}{digits}"
+    return '+' + digits
+
+
+def aadhaar_key(number, secret_key):
+    """
+    Keyed HMAC-SHA256 of the Aadhaar digits. Stored in a unique index instead of
+    the plaintext so duplicate checks stay O(log n) without indexing the number.
+    """
+    digits = re.sub(r'\D', '', str(number or ''))
+    if not digits:
+        return ''
+    return hmac.new(secret_key.encode('utf-8'), digits.encode('ascii'), hashlib.sha256).hexdigest()
+
+
+def mask_phone(number):
+    """Keep only the last four digits visible, e.g. ******3210"""
+    digits = re.sub(r'\D', '', str(number or ''))
+    if len(digits) <= 4:
+        return '*' * len(digits)
+    return '*' * (len(digits) - 4) + digits[-4:]
+
+
+def prefix_regex(text):
+    # Anchored, case-sensitive regex on a literal: MongoDB turns this into an index range
+    return {'$regex': '^' + re.escape(text)}
+
+
+def name_prefix_query(term):
+    """
+    Query matching patients where every word of `term` is a prefix of some word
+    of their name, e.g. "ra ku" matches "Ravi Kumar". Returns None when the
+    term has no searchable characters.
+    """
+    tokens = normalize_name(term).split()
+    if not tokens:
+        return None
+    clauses = [{'name_tokens': prefix_regex(token)} for token in tokens]
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+
+def patient_lookup_query(term):
+    """Name, phone or patient ID prefix search used by the free-text search boxes"""
+    term = (term or '').strip()
+    clauses = [{'patient_id': prefix_regex(term.upper())}]
+    phone_prefix = phone_prefix_key(term)
+    if phone_prefix:
+        clauses.append({'phone_key': prefix_regex(phone_prefix)})
+    name_query = name_prefix_query(term)
+    if name_query:
+        clauses.insert(0, name_query)
+    return {'$or': clauses}
@@ -0,0 +1,77 @@
+# app/utils/search_cache.py
+from app.utils.cache import TTLCache
+from app.utils.search import normalize_name, phone_key, phone_prefix_key
+
+
+def _name_matches(term, name_tokens):
+    # Same rule as search.name_prefix_query: every term word prefixes some name word
+    terms = normalize_name(term).split()
+    return bool(terms) and all(any(token.startswith(t) for token in name_tokens) for t in terms)
+
+
+class SearchResultCache:
+    """
+    Caches patient search responses keyed by (endpoint, role, normalized query).
+    Each entry remembers which patients it contains so a write can drop exactly
+    the entries it affects: those that contain the patient, and those whose
+    query the patient's new values would now match.
+    """
+
+    def __init__(self, maxsize=512, ttl=60):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def key(endpoint, role, **query):
+        return (endpoint, role, tuple(sorted(query.items())))
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        return entry['payload'] if entry else None
+
+    def set(self, key, payload, patient_ids):
+        self._cache.set(key, {
+            'payload': payload,
+            'patient_ids': frozenset(str(patient_id) for patient_id in patient_ids)
+        })
+
+    def invalidate_patients(self, patient_ids):
+        """Drop entries containing any of these patients, e.g. after a visit write"""
+        patient_ids = {str(patient_id) for patient_id in patient_ids}
+        self._cache.invalidate_where(lambda key, entry: not entry['patient_ids'].isdisjoint(patient_ids))
+
+    def invalidate_patient_write(self, patient_id, patient):
+        """
+        Drop entries affected by registering/updating `patient` (its new field
+        values): entries that contain it plus entries it would now match.
+        """
+        patient_id = str(patient_id)
+        name_tokens = normalize_name(patient.get('name', '')).split()
+        patient_phone_key = phone_key(patient.get('contact_number', ''))
+
+        def would_match(key):
+            endpoint, _, query = key
+            query = dict(query)
+            if endpoint == 'by_phone':
+                return query['phone'] == patient_phone_key
+            if endpoint == 'by_name':
+                return query.get('fuzzy') or _name_matches(query['name'], name_tokens)
+            if endpoint == 'search':
+                return (not query['phone'] or query['phone'] == patient_phone_key) and \
+                       (not query['name'] or _name_matches(query['name'], name_tokens))
+            if endpoint == 'doctor_search':
+                term = query['term']
+                phone_prefix = phone_prefix_key(term)
+                return _name_matches(term, name_tokens) or \
+                       (phone_prefix and patient_phone_key.startswith(phone_prefix)) or \
+                       patient.get('patient_id', '').startswith(term.upper())
+            return True
+
+        self._cache.invalidate_where(
+            lambda key, entry: patient_id in entry['patient_ids'] or would_match(key)
+        )
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
@@ -0,0 +1,77 @@
+# app/utils/stats.py
+from datetime import date, datetime, timedelta
+
+
+def count_patients_with_visits(visits):
+    """
+    Number of distinct patients with at least one visit, counted by the server
+    so the client receives one small document however many visits exist.
+    Sorting on `patient_id` first lets the server walk that index instead of
+    fetching every visit document. Visits without a patient_id are not counted.
+    """
+    result = list(visits.aggregate([
+        {'$match': {'patient_id': {'$ne': None}}},
+        {'$sort': {'patient_id': 1}},
+        {'$group': {'_id': '$patient_id'}},
+        {'$count': 'count'}
+    ], allowDiskUse=True))
+    return result[0]['count'] if result else 0
+
+
+def age_in_years(date_of_birth, today=None):
+    """
+    Completed years between `date_of_birth` and `today` (default now); the
+    year only counts once the birthday has been reached. Returns 0 when the
+    date of birth is missing or not a date.
+    """
+    if not isinstance(date_of_birth, date):
+        return 0
+    today = today or datetime.now()
+    birthday_pending = (today.month, today.day) < (date_of_birth.month, date_of_birth.day)
+    return today.year - date_of_birth.year - birthday_pending
+
+
+def _years_before(day, years):
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)  # 29 Feb in a non-leap year
+
+
+def age_histogram(patients, match=None, today=None, bucket_years=10, max_age=100):
+    """
+    Patient counts per age band, bucketed by the server on `date_of_birth`.
+    Ages are turned into birth-date boundaries once (age >= a exactly when
+    date_of_birth < today - a years + 1 day), so no per-document age math is
+    needed. Returns [{'_id': min_age, 'max_age': ..., 'count': ...}, ...]
+    youngest first; the last band is open ended (max_age None) and patients
+    without a usable date of birth are counted under '_id': 'Unknown'.
+    """
+    today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    ages = list(range(0, max_age + 1, bucket_years))
+
+    def cutoff(age):
+        return _years_before(today, age) + timedelta(days=1)
+
+    # Oldest band first: $bucket needs ascending boundaries
+    boundaries = [datetime(1, 1, 1)] + [cutoff(age) for age in reversed(ages)]
+    pipeline = [{'$match': match}] if match else []
+    pipeline.append({'$bucket': {
+        'groupBy': '$date_of_birth',
+        'boundaries': boundaries,
+        'default': 'Unknown',
+        'output': {'count': {'$sum': 1}}
+    }})
+    counts = {row['_id']: row['count'] for row in patients.aggregate(pipeline)}
+
+    histogram = []
+    for index, age in enumerate(ages):
+        upper = ages[index + 1] if index + 1 < len(ages) else None
+        lower_boundary = boundaries[len(ages) - 1 - index]  # Bucket _id is its lower boundary
+        histogram.append({
+            '_id': age,
+            'max_age': upper - 1 if upper is not None else None,
+            'count': counts.get(lower_boundary, 0)
+        })
+    histogram.append({'_id': 'Unknown', 'max_age': None, 'count': counts.get('Unknown', 0)})
+    return histogram
@@ -0,0 +1,91 @@
+# app/utils/tokens.py
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import threading
+import time
+
+
+def _b64encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _sign(secret_key, payload_part):
+    return hmac.new(secret_key.encode('utf-8'), payload_part.encode('ascii'), hashlib.sha256).digest()
+
+
+def issue_token(secret_key, principal_id, role, username, name, ttl=900):
+    """
+    Create a signed bearer token "<payload>.<signature>" for an admin/doctor.
+    The payload carries everything needed to rebuild the user without a DB lookup.
+    """
+    now = int(time.time())
+    payload = {
+        'sub': str(principal_id),
+        'role': role,
+        'username': username,
+        'name': name,
+        'iat': now,
+        'exp': now + ttl,
+        'jti': secrets.token_urlsafe(12)
+    }
+    payload_part = _b64encode(json.dumps(payload, separators=(',', ':')).encode('utf-8'))
+    return f"{payload_part}.{_b64encode(_sign(secret_key, payload_part))}"
+
+
+def decode_token(secret_key, token):
+    """Return the payload of a correctly signed, unexpired token, otherwise None"""
+    try:
+        payload_part, signature_part = token.split('.', 1)
+        if not hmac.compare_digest(_sign(secret_key, payload_part), _b64decode(signature_part)):
+            return None
+        payload = json.loads(_b64decode(payload_part))
+    except (ValueError, TypeError):
+        return None
+
+    if payload.get('exp', 0) < time.time():
+        return None
+    return payload
+
+
+class RevocationList:
+    """
+    In-memory set of revoked token ids, reloaded from `loader` at most once per
+    `refresh_interval` seconds so token checks normally stay off the database.
+    """
+
+    def __init__(self, loader, refresh_interval=30):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._revoked = frozenset()
+        self._loaded_at = float('-inf')
+        self._lock = threading.Lock()
+
+    def _refresh_if_stale(self):
+        if time.monotonic() - self._loaded_at < self.refresh_interval:
+            return
+        with self._lock:
+            if time.monotonic() - self._loaded_at < self.refresh_interval:
+                return
+            try:
+                self._revoked = frozenset(self.loader())
+            except Exception as e:
+                # Keep serving the last known list rather than failing every token check
+                logging.error(f"Token revocation list refresh failed: {e}")
+            self._loaded_at = time.monotonic()
+
+    def add(self, jti):
+        # Applies locally at once; other workers pick it up on their next refresh
+        with self._lock:
+            self._revoked = self._revoked | {jti}
+
+    def is_revoked(self, jti):
+        self._refresh_if_stale()
+        return jti in self._revoked
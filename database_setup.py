@@ -1,13 +1,24 @@
-from pymongo import MongoClient, ASCENDING, DESCENDING
-from datetime import datetime
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import BulkWriteError
+from datetime import datetime, timedelta
 import logging
+import os
+import sys
+from app.utils.search import name_search_keys, phone_key, aadhaar_key
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Patients without the derived keys the search endpoints query; they are invisible to search until backfilled
+MISSING_SEARCH_KEYS = {"$or": [
+    {"name_search": {"$exists": False}},
+    {"name_phonetic": {"$exists": False}},
+    {"phone_key": {"$exists": False}}
+]}
+
 def setup_database_indexes(mongo_uri):
-    """Setup database indexes for optimal performance"""
+    """Setup database indexes for optimal performance and backfill the patient search keys they serve"""
     try:
         client = MongoClient(mongo_uri)
         db = client.careorbit_db
@@ -17,8 +28,18 @@ def setup_database_indexes(mongo_uri):
         db.patient.create_index([("patient_id", ASCENDING)], unique=True)
         db.patient.create_index([("name", ASCENDING)])
         db.patient.create_index([("created_at", DESCENDING)])
-        
-        db.patient.create_index([("aadhaar_number", ASCENDING)], unique=True, sparse=True)
+        db.patient.create_index([("name_search", ASCENDING)])
+        db.patient.create_index([("name_tokens", ASCENDING)])  # Multikey, serves anchored prefix searches
+        db.patient.create_index([("phone_key", ASCENDING)])
+        db.patient.create_index([("name_phonetic", ASCENDING)])
+        db.patient.create_index([("name_trigrams", ASCENDING)])
+        # Covering indexes for /api/patients/suggest (every projected field is in the key)
+        db.patient.create_index([("name_search", ASCENDING), ("_id", ASCENDING), ("patient_id", ASCENDING), ("name", ASCENDING), ("contact_number", ASCENDING)])
+        db.patient.create_index([("patient_id", ASCENDING), ("_id", ASCENDING), ("name", ASCENDING), ("contact_number", ASCENDING)])
+        
+        # Duplicate Aadhaar checks go through a keyed hash; migrate_aadhaar_hashes drops the
+        # plaintext aadhaar_number index once every number has been hashed
+        db.patient.create_index([("aadhaar_hash", ASCENDING)], unique=True, sparse=True)
         
         db.patient.create_index([
             ("name", ASCENDING), 
@@ -44,6 +65,20 @@ def setup_database_indexes(mongo_uri):
         # Admin collection indexes
         db.admin.create_index([("username", ASCENDING)], unique=True)
         
+        # Revoked API tokens are only needed until the token itself would have expired
+        db.revoked_tokens.create_index([("jti", ASCENDING)], unique=True)
+        db.revoked_tokens.create_index([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        
+        # Background export jobs; records are purged at `purge_at`, which is only set once
+        # the job no longer owns an artifact on disk
+        db.jobs.create_index([("created_by", ASCENDING), ("created_at", DESCENDING)])
+        db.jobs.create_index([("status", ASCENDING), ("expires_at", ASCENDING)])
+        db.jobs.create_index([("status", ASCENDING), ("updated_at", ASCENDING)])
+        db.jobs.create_index([("purge_at", ASCENDING)], name="jobs_purge_ttl", expireAfterSeconds=0)
+        
+        # Per-doctor daily open-visit counters
+        db.doctor_load.create_index([("doctor_id", ASCENDING), ("date", ASCENDING)], unique=True)
+        
         # Department collection indexes
         db.department.create_index([("department_name", ASCENDING)], unique=True)
         
@@ -90,12 +125,139 @@ def setup_database_indexes(mongo_uri):
         db.visit_summary.create_index([("patient_id", ASCENDING), ("visit_date", DESCENDING)])
         
         logger.info("Database indexes created successfully")
-        return True
+        
+        # Existing patients need the search keys before the new indexes can find them
+        return backfill_patient_search_keys(mongo_uri) is not None
         
     except Exception as e:
         logger.error(f"Error creating database indexes: {str(e)}")
         return False
 
+def backfill_patient_search_keys(mongo_uri, batch_size=1000):
+    """Fill the name/phone search keys for patients registered before they existed"""
+    try:
+        client = MongoClient(mongo_uri)
+        db = client.careorbit_db
+        
+        updated = 0
+        batch = []
+        for patient in db.patient.find(MISSING_SEARCH_KEYS, {"name": 1, "contact_number": 1}):
+            keys = name_search_keys(patient.get("name", ""))
+            keys["phone_key"] = phone_key(patient.get("contact_number", ""))
+            batch.append(UpdateOne({"_id": patient["_id"]}, {"$set": keys}))
+            if len(batch) >= batch_size:
+                updated += db.patient.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        
+        if batch:
+            updated += db.patient.bulk_write(batch, ordered=False).modified_count
+        
+        logger.info(f"Backfilled search keys for {updated} patients")
+        return updated
+        
+    except Exception as e:
+        logger.error(f"Error backfilling patient search keys: {str(e)}")
+        return None
+
+def migrate_aadhaar_hashes(mongo_uri, hash_key, batch_size=1000, rehash=False):
+    """
+    Store the keyed hash of every plaintext Aadhaar number that has none yet.
+    With rehash=True every stored hash is recomputed, which is required after
+    AADHAAR_HASH_KEY changes. The old unique index on the plaintext number is
+    dropped only after a backfill without conflicts, so uniqueness is always
+    enforced by at least one index.
+    """
+    try:
+        client = MongoClient(mongo_uri)
+        db = client.careorbit_db
+        
+        hashed = 0
+        conflicts = 0
+        batch = []
+        pending = {"aadhaar_number": {"$nin": ["", None]}}
+        if not rehash:
+            pending["aadhaar_hash"] = {"$exists": False}
+        
+        def flush(batch):
+            try:
+                return db.patient.bulk_write(batch, ordered=False).modified_count, 0
+            except BulkWriteError as bwe:
+                # Duplicate Aadhaar numbers already in the data; reported by validate_database_integrity
+                return bwe.details.get("nModified", 0), len(bwe.details.get("writeErrors", []))
+        
+        for patient in db.patient.find(pending, {"aadhaar_number": 1}):
+            key = aadhaar_key(patient["aadhaar_number"], hash_key)
+            if key:
+                batch.append(UpdateOne({"_id": patient["_id"]}, {"$set": {"aadhaar_hash": key}}))
+            if len(batch) >= batch_size:
+                modified, failed = flush(batch)
+                hashed += modified
+                conflicts += failed
+                batch = []
+        
+        if batch:
+            modified, failed = flush(batch)
+            hashed += modified
+            conflicts += failed
+        
+        logger.info(f"Hashed Aadhaar numbers for {hashed} patients ({conflicts} duplicates skipped)")
+        
+        if conflicts:
+            logger.warning("Keeping the aadhaar_number index until the duplicate Aadhaar numbers are resolved")
+        elif "aadhaar_number_1" in db.patient.index_information():
+            db.patient.drop_index("aadhaar_number_1")
+            logger.info("Dropped the plaintext aadhaar_number index")
+        return hashed
+        
+    except Exception as e:
+        logger.error(f"Error migrating Aadhaar hashes: {str(e)}")
+        return None
+
+def reconcile_doctor_loads(mongo_uri, days=1):
+    """Recount open visits per doctor for the last `days` days and overwrite any drifted doctor_load counters"""
+    try:
+        client = MongoClient(mongo_uri)
+        db = client.careorbit_db
+        
+        today = datetime.combine(datetime.now().date(), datetime.min.time())
+        fixed = 0
+        for offset in range(days):
+            start = today - timedelta(days=offset)
+            date_key = start.strftime("%Y-%m-%d")
+            counts = {
+                row["_id"]: row["active"]
+                for row in db.visit.aggregate([
+                    {"$match": {
+                        "visit_date": {"$gte": start, "$lt": start + timedelta(days=1)},
+                        "status": {"$in": ["assigned", "in_progress"]}
+                    }},
+                    {"$group": {"_id": "$doctor_id", "active": {"$sum": 1}}}
+                ])
+            }
+            
+            operations = []
+            for load in db.doctor_load.find({"date": date_key}):
+                expected = counts.pop(load["doctor_id"], 0)
+                if load.get("active") != expected:
+                    operations.append(UpdateOne({"_id": load["_id"]}, {"$set": {"active": expected}}))
+            for doctor_id, expected in counts.items():
+                operations.append(UpdateOne(
+                    {"doctor_id": doctor_id, "date": date_key},
+                    {"$set": {"active": expected}},
+                    upsert=True
+                ))
+            
+            if operations:
+                db.doctor_load.bulk_write(operations, ordered=False)
+                fixed += len(operations)
+        
+        logger.info(f"Reconciled doctor load counters ({fixed} corrected)")
+        return fixed
+        
+    except Exception as e:
+        logger.error(f"Error reconciling doctor loads: {str(e)}")
+        return None
+
 def validate_database_integrity(mongo_uri):
     """Validate database integrity and relationships"""
     try:
@@ -168,6 +330,11 @@ def validate_database_integrity(mongo_uri):
         for dup in aadhaar_duplicates:
             issues.append(f"Duplicate Aadhaar number: {dup['_id']} (Patient IDs: {dup['patients']})")
         
+        # Patients the search endpoints cannot find
+        missing_search_keys = db.patient.count_documents(MISSING_SEARCH_KEYS)
+        if missing_search_keys:
+            issues.append(f"{missing_search_keys} patients lack search keys; run backfill_patient_search_keys")
+        
         if issues:
             logger.warning(f"Database integrity issues found: {issues}")
         else:
@@ -406,7 +573,13 @@ def get_database_stats(mongo_uri):
 if __name__ == "__main__":
     # Setup database when run directly
     mongo_uri = "mongodb://localhost:27017/"
-    setup_database_indexes(mongo_uri)
+    # Must match the app's AADHAAR_HASH_KEY
+    aadhaar_hash_key = os.getenv("AADHAAR_HASH_KEY")
+    if not aadhaar_hash_key:
+        sys.exit("AADHAAR_HASH_KEY must be set to the value the app uses")
+    setup_database_indexes(mongo_uri)  # Also backfills patient search keys
+    migrate_aadhaar_hashes(mongo_uri, aadhaar_hash_key, rehash="--rehash-aadhaar" in sys.argv)
+    reconcile_doctor_loads(mongo_uri)
     create_patient_history_structure(mongo_uri)
     migrate_existing_data_to_history(mongo_uri)
     validate_database_integrity(mongo_uri)
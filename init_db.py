@@ -616,6 +616,8 @@ def initialize_database():
         doctor_results = db.doctor.insert_many(doctors)
         doctor_ids = doctor_results.inserted_ids
         logger.info(f"Created {len(doctors)} doctors")
+        # Running app workers reload their department/doctor cache when this version changes
+        db.counters.update_one({'_id': 'reference_data'}, {'$inc': {'seq': 1}}, upsert=True)
 
         # Create sample patients for testing
         sample_patients = [
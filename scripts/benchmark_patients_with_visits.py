@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the "patients with visits" statistic.
+
+Compares the server-side count used by /api/patients/stats with the old
+approach of pulling every visit.patient_id into Python and sending it back as
+an $in list. Visits are added to a scratch database in steps (by default up
+to 1M) and each step reports wall time and the client's peak Python memory.
+The old approach is the baseline column; both are saved with the run's
+parameters and server version to a JSON file (--output) so a run can be kept
+next to the change it measured and compared with later runs.
+
+    python scripts/benchmark_patients_with_visits.py --uri mongodb://localhost:27017/
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+from bson import BSON
+from bson.objectid import ObjectId
+from pymongo import MongoClient, ASCENDING
+from pymongo.errors import DocumentTooLarge
+
+# Add the parent directory to the path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.stats import count_patients_with_visits
+
+
+def measure(fn):
+    """Run fn, returning (result, seconds, peak client memory in KB)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+    except (DocumentTooLarge, MemoryError) as e:
+        result = f"failed: {type(e).__name__}"
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak // 1024
+
+
+def legacy_count(db):
+    # The query get_patients_stats used to run
+    patient_ids = [visit['patient_id'] for visit in db.visit.find({}, {'patient_id': 1})]
+    return db.patient.count_documents({'_id': {'$in': patient_ids}})
+
+
+def seed(db, patient_ids, count, batch_size=10000):
+    now = time.time()
+    for start in range(0, count, batch_size):
+        db.visit.insert_many([
+            {'patient_id': random.choice(patient_ids), 'visit_date': now, 'status': 'completed'}
+            for _ in range(min(batch_size, count - start))
+        ], ordered=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--database', default='careorbit_benchmark')
+    parser.add_argument('--patients', type=int, default=100000)
+    parser.add_argument('--steps', default='10000,100000,1000000', help='Comma-separated visit totals')
+    parser.add_argument('--skip-legacy', action='store_true', help='Only measure the server-side count')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch database afterwards')
+    parser.add_argument('--output', default='benchmark_patients_with_visits_results.json',
+                        help='Where to save the results as JSON')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    client.drop_database(args.database)
+    db = client[args.database]
+    db.visit.create_index([('patient_id', ASCENDING)])
+
+    patient_ids = [ObjectId() for _ in range(args.patients)]
+    for start in range(0, len(patient_ids), 10000):
+        db.patient.insert_many([{'_id': patient_id} for patient_id in patient_ids[start:start + 10000]])
+
+    results = []
+    print(f"{'visits':>10} | {'server count':>12} {'time s':>8} {'peak KB':>9} | "
+          f"{'legacy count':>12} {'time s':>8} {'peak KB':>9} {'$in MB':>7}")
+    seeded = 0
+    try:
+        for total in sorted(int(step) for step in args.steps.split(',')):
+            seed(db, patient_ids, total - seeded)
+            seeded = total
+
+            count, elapsed, peak = measure(lambda: count_patients_with_visits(db.visit))
+            line = f"{total:>10} | {count:>12} {elapsed:>8.2f} {peak:>9} |"
+            result = {'visits': total, 'server': {'count': count, 'seconds': round(elapsed, 4), 'peak_kb': peak}}
+            results.append(result)
+
+            if args.skip_legacy:
+                print(line)
+                continue
+            legacy, legacy_elapsed, legacy_peak = measure(lambda: legacy_count(db))
+            in_size = len(BSON.encode({'_id': {'$in': [ObjectId()] * total}})) / (1024 * 1024)
+            result['legacy'] = {
+                'count': legacy, 'seconds': round(legacy_elapsed, 4), 'peak_kb': legacy_peak,
+                'in_list_mb': round(in_size, 1)
+            }
+            print(f"{line} {legacy:>12} {legacy_elapsed:>8.2f} {legacy_peak:>9} {in_size:>7.1f}")
+    finally:
+        if not args.keep:
+            client.drop_database(args.database)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'timestamp': datetime.now().isoformat(),
+            'server_version': client.server_info().get('version'),
+            'python': platform.python_version(),
+            'patients': args.patients,
+            'results': results
+        }, f, indent=2)
+    print(f"\n📄 Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Checks for the shared age helper used by the dashboards, search results and
+reports. Runs without a database:
+
+    python scripts/test_age_calculation.py
+"""
+
+import os
+import sys
+from datetime import date, datetime
+
+# Add the parent directory to the path to import app modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.stats import age_in_years
+
+TODAY = datetime(2026, 10, 16, 9, 30)
+
+CASES = [
+    ('birthday today', datetime(2000, 10, 16), 26),
+    ('birthday tomorrow', datetime(2000, 10, 17), 25),
+    ('birthday yesterday', datetime(2000, 10, 15), 26),
+    ('birthday later this year', datetime(2000, 12, 1), 25),
+    # Earlier month but later day: the old check compared today's month with itself and got 25
+    ('earlier month, later day', datetime(2000, 3, 20), 26),
+    ('born today', datetime(2026, 10, 16), 0),
+    ('plain date value', date(1990, 1, 1), 36),
+    ('time of day ignored', datetime(2000, 10, 16, 23, 59), 26),
+    ('missing', None, 0),
+    ('not a date', '2000-01-01', 0),
+]
+
+
+def run():
+    failures = 0
+    for name, date_of_birth, expected in CASES:
+        actual = age_in_years(date_of_birth, TODAY)
+        passed = actual == expected
+        failures += not passed
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"{status}: {name}" + ("" if passed else f" (expected {expected}, got {actual})"))
+
+    # 29 February birthdays count from 1 March in non-leap years
+    leap_cases = [(datetime(2027, 2, 28), 26), (datetime(2027, 3, 1), 27), (datetime(2028, 2, 29), 28)]
+    for today, expected in leap_cases:
+        actual = age_in_years(datetime(2000, 2, 29), today)
+        passed = actual == expected
+        failures += not passed
+        status = "✅ PASS" if passed else "❌ FAIL"
+        print(f"{status}: leap-day birthday on {today:%Y-%m-%d}" + ("" if passed else f" (expected {expected}, got {actual})"))
+
+    print(f"\n{'All age checks passed' if not failures else f'{failures} age check(s) failed'}")
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if run() else 1)
@@ -19,6 +19,11 @@ class TestsIntegrationTester:
         self.session = requests.Session()
         self.test_results = []
         
+        # Use a bearer token from /api/auth/token instead of a login cookie when provided
+        api_token = os.getenv("CAREORBIT_API_TOKEN")
+        if api_token:
+            self.session.headers["Authorization"] = f"Bearer {api_token}"
+        
     def log_test(self, test_name, success, message=""):
         """Log test results"""
         status = "✅ PASS" if success else "❌ FAIL"